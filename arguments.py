@@ -24,19 +24,27 @@ arg_dic = {
     "init_checkpoint": BERT_BASE_DIR + 'bert_model.ckpt',
     # "Initial checkpoint (usually from a pre-trained BERT model).
     "do_lower_case": True,
+    "tokenizer_cache_size": 100000,  # 分词缓存：空白切分后的词 -> wordpiece 结果，0 表示不缓存
     "max_seq_length": 250, # 是每个样本的最大长度，也就是最大单词数。
+    "length_buckets": [32, 64, 128],  # 按真实长度分桶，只补齐到桶边界；max_seq_length 总是最后一个桶，[] 表示不分桶
+    "bucket_window_batches": 16,  # 训练/评估分桶时一次解析多少批记录，在这个范围内按长度排序后再切成小批
     "do_train": True,
     "do_eval": True,
     "do_predict": False,
     "train_batch_size": 32,
     "eval_batch_size": 8,
     "predict_batch_size": 8,
+    "shuffle_buffer_size": 10000,  # 训练时打乱用的缓冲区(条数)，越大越接近全局打乱，占用内存约为条数乘单条记录大小
     "learning_rate": 3e-5,
     "num_train_epochs": 5,
     "warmup_proportion": 0.1,  # "Proportion of training to perform linear learning rate warmup for. "
     # "E.g., 0.1 = 10% of training."
     "save_checkpoints_steps": 100,  # How often to save the model checkpoint."
     "iterations_per_loop": 1000,  # "How many steps to make in each estimator call.
+    "feature_workers": 0,  # 写TFRecord特征时的进程数，0 表示使用全部CPU核，1 表示在当前进程里串行转换
+    "feature_format": 'tfrecord',  # 特征存储格式：tfrecord，或 npy(内存映射的定长矩阵，读取时不用解析protobuf)
+    "feature_cache": True,  # 按数据文件、词表、max_seq_length、标签的内容缓存特征，都没变时不再重新分词
+    "feature_cache_incremental": False,  # 数据文件只在末尾追加了新行时，只转换新增的行
 
     "use_tpu": False,
     "tpu_name": False,
@@ -44,4 +52,29 @@ arg_dic = {
     "gcp_project": False,
     "master": False,
     "num_tpu_cores": False,  # "Only used if `use_tpu` is True. Total number of TPU cores to use."
+
+    # 服务端动态批处理：凑够 max_batch_size 条或者等待超过 max_wait_ms 毫秒就执行一次前向计算
+    "max_batch_size": 32,
+    "max_wait_ms": 5,
+    "max_queue_size": 2000,  # 排队等待推理的最大条数，超过后直接返回503而不是无限堆积
+    "batch_max_items": 10000,  # /batch 接口单次请求最多包含的条数
+    "cache_size": 100000,  # 判定结果缓存的最大条数(LRU淘汰)，0 表示关闭缓存
+    "cache_ttl": 0,  # 缓存条目的有效期(秒)，0 表示不过期
+    # 级联预筛：哈希n-gram逻辑回归给出的恶意概率低于阈值时直接判为正常，不再跑BERT；阈值为 0 表示关闭
+    "prefilter_file": './pb/prefilter.pkl',
+    "prefilter_threshold": 0.0,
+    "prefilter_benign_label": '0',
+    # 长文本滑动窗口：整条文本切成相互重叠的 max_seq_length 窗口分别打分，再按 max/mean/noisy_or 汇总成整条的恶意概率
+    "window_mode": False,
+    "window_stride": 128,  # 相邻窗口起点相隔的token数，小于 max_seq_length-2 时窗口互相重叠
+    "window_max_windows": 16,  # 每条输入最多打分的窗口数，超出部分不再分词
+    "window_aggregate": 'max',  # max：最可疑的窗口；mean：各窗口平均；noisy_or：1-∏(1-p)
+    "window_threshold": 0.5,  # 某个窗口的恶意概率超过它时，这条输入剩下的窗口不再计算
+    "window_batch_size": 64,  # 一次前向计算最多包含的窗口数(各条输入的窗口拼在一起)
+    # pre-fork 多进程服务：父进程加载一次模型后fork出的工作进程数，1 表示单进程
+    "workers": 1,
+    # pre-fork 时各工作进程共用一份 mmap 的模型权重(每批 feed 进图)，省内存但每批多一些开销，先用 benchmark.py weights 测过再打开
+    "share_weights": False,
+    # 工作进程绑核：None 不绑；'auto' 把所有CPU平均分给各进程；或者逐个指定，如 [[0, 1], [2, 3]]
+    "worker_cpu_affinity": None,
 }
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+'''
+@desc: 动态微批调度器。把短时间窗口内到达的多个预测请求合并成一个batch，只做一次前向计算，
+       再把结果分别交还给各个调用方。
+'''
+import time
+import threading
+import collections
+from concurrent.futures import Future
+from queue import Queue, Empty, Full
+
+
+class BatchScheduler(object):
+    """Collects single predictions into micro-batches for one forward pass.
+
+    `predict_fn` receives a list of items and must return a list of results in
+    the same order. A batch is dispatched once `max_batch_size` items are
+    queued or the oldest item has waited `max_wait_ms`, whichever comes first.
+    `max_queue_size` bounds the number of waiting items (0 means unbounded);
+    `submit` raises `queue.Full` when it is exceeded.
+
+    `close` never blocks on a full queue: items already queued are still
+    predicted, then the scheduler thread exits.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=32, max_wait_ms=5, max_queue_size=0):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be >= 1, got %d" % max_batch_size)
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue = Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self._batch_sizes = collections.Counter()  # batch大小 -> 出现次数
+        self._latencies = collections.deque(maxlen=10000)  # 最近若干条请求从提交到出结果的耗时(秒)
+        self._num_rejected = 0
+        self._num_items = 0
+        self._num_errors = 0
+        self._closed = False
+        self._stopping = threading.Event()
+
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        """Queues one item and returns a `concurrent.futures.Future` for its result."""
+        if self._stopping.is_set():
+            raise RuntimeError("BatchScheduler is closed")
+        future = Future()
+        try:
+            self._queue.put_nowait((item, future, time.monotonic()))
+        except Full:
+            with self._lock:
+                self._num_rejected += 1
+            raise
+        return future
+
+    def close(self, timeout=None):
+        self._stopping.set()
+        try:
+            self._queue.put_nowait(None)
+        except Full:
+            pass  # 队列满时放不进结束标记，调度线程处理完剩下的请求、发现队列空了就会看到停止标志
+        self._thread.join(timeout)
+
+    def _collect(self):
+        if self._closed:
+            return None
+        while True:  # 等待第一个请求，队列空了并且已经 close 就退出
+            try:
+                first = self._queue.get(timeout=0.1)
+                break
+            except Empty:
+                if self._stopping.is_set():
+                    return None
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=remaining)
+            except Empty:
+                break
+            if entry is None:
+                self._closed = True  # 处理完这一批就退出
+                break
+            batch.append(entry)
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            # 调用方已经取消的请求不再参与计算
+            batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                results = list(self.predict_fn([item for item, _, _ in batch]))
+                if len(results) != len(batch):
+                    raise RuntimeError("predict_fn returned %d results for a batch of %d" % (len(results), len(batch)))
+            except Exception as e:
+                with self._lock:
+                    self._num_errors += 1
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            now = time.monotonic()
+            with self._lock:
+                self._batch_sizes[len(batch)] += 1
+                self._num_items += len(batch)
+                self._latencies.extend(now - t0 for _, _, t0 in batch)
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        """Returns counters describing the batch sizes achieved so far."""
+        with self._lock:
+            sizes = dict(self._batch_sizes)
+            num_items, num_errors = self._num_items, self._num_errors
+            num_rejected = self._num_rejected
+            latencies = sorted(self._latencies)
+        num_batches = sum(sizes.values())
+
+        def percentile(q):
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000.0
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000.0,
+            'queue_depth': self.queue_depth(),
+            'num_batches': num_batches,
+            'num_items': num_items,
+            'num_errors': num_errors,
+            'num_rejected': num_rejected,
+            'avg_batch_size': num_items / num_batches if num_batches else 0.0,
+            'batch_size_hist': {str(k): sizes[k] for k in sorted(sizes)},
+            'latency_ms': {'p50': percentile(0.5), 'p90': percentile(0.9), 'p99': percentile(0.99)},
+        }
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+'''
+@desc: 性能基准测试脚本。用法：python benchmark.py <测试项> [参数]，默认使用 data 目录里的样本。
+'''
+import os
+import glob
+import time
+import argparse
+
+from example_reader import load_samples
+
+
+def report(name, seconds, count):
+    print('{:<24s} {:8.3f} s  {:10.1f} 条/秒'.format(name, seconds, count / seconds if seconds else 0.0))
+
+
+def bench_buckets(args):
+    """长度分桶：统计补齐的token数、估算计算量，有导出的pb模型时再实测吞吐。"""
+    from predict import SessionPredictor
+    from train_eval import (arg_dic, tokenization, modeling, InputExample, convert_examples_to_arrays,
+                            get_length_buckets, bucket_length)
+
+    samples = load_samples(args.data or './data/test.txt', args.limit)
+    max_seq_length = arg_dic['max_seq_length']
+    buckets = get_length_buckets(max_seq_length)
+    if not buckets:
+        print('length_buckets 为空，没有开启分桶')
+        return
+    tokenizer = tokenization.FullTokenizer(vocab_file=arg_dic['vocab_file'], do_lower_case=arg_dic['do_lower_case'])
+    label_list = sorted(set(label for label, _ in samples))
+    features = convert_examples_to_arrays([InputExample('bench-%d' % i, text, label=label)
+                                           for i, (label, text) in enumerate(samples)],
+                                          label_list, max_seq_length, tokenizer)
+    lengths = features.lengths.tolist()
+
+    # 每层Transformer的计算量近似为 24*L*H^2（各种投影和FFN）+ 4*L^2*H（注意力）
+    hidden = modeling.BertConfig.from_json_file(arg_dic['bert_config_file']).hidden_size
+    cost = lambda length: 24 * length * hidden * hidden + 4 * length * length * hidden
+    fixed_cost = cost(max_seq_length) * len(lengths)
+    bucket_cost = sum(cost(bucket_length(n, buckets)) for n in lengths)
+
+    print('样本数 {}，平均真实长度 {:.1f}，长度桶 {}'.format(len(lengths), sum(lengths) / len(lengths), buckets))
+    for b in buckets:
+        print('  桶 {:>4d}: {} 条'.format(b, sum(1 for n in lengths if bucket_length(n, buckets) == b)))
+    print('补齐后的token数：固定长度 {}，分桶 {}'.format(max_seq_length * len(lengths),
+                                            sum(bucket_length(n, buckets) for n in lengths)))
+    print('估算计算量之比（固定长度/分桶）：{:.2f}x'.format(fixed_cost / bucket_cost))
+
+    pb_file = os.path.join(arg_dic['pb_model_dir'], 'classification_model.pb')
+    if not os.path.exists(pb_file):
+        print('没有找到 {}，跳过实测'.format(pb_file))
+        return
+    predictor = SessionPredictor.from_pb(pb_file)
+    if predictor.seq_length is not None:
+        print('pb模型的序列长度固定为 {}，请用新版 save_PBmodel 重新导出后再实测'.format(predictor.seq_length))
+        return
+    batches = [features.take(slice(i, i + args.batch_size)) for i in range(0, len(features), args.batch_size)]
+    predictor.predict(batches[0])  # 预热
+
+    start = time.perf_counter()
+    for batch in batches:
+        predictor.predict(batch)
+    report('固定长度 %d' % max_seq_length, time.perf_counter() - start, len(features))
+
+    start = time.perf_counter()
+    for batch in batches:
+        predictor.predict_bucketed(batch, buckets)
+    report('长度分桶', time.perf_counter() - start, len(features))
+
+
+def bench_weights(args):
+    """共享权重：同一个pb分别以常量权重和 mmap feed 的权重加载，比对输出并比较每批延迟。"""
+    import tempfile
+    import numpy as np
+    from predict import SessionPredictor, load_graph_def
+    from shared_weights import save_weights, SharedWeights
+    from train_eval import arg_dic, tokenization, InputExample, convert_examples_to_arrays
+
+    pb_file = os.path.join(arg_dic['pb_model_dir'], 'classification_model.pb')
+    samples = load_samples(args.data or './data/test.txt', args.limit or args.batch_size * 20)
+    tokenizer = tokenization.FullTokenizer(vocab_file=arg_dic['vocab_file'], do_lower_case=arg_dic['do_lower_case'])
+    features = convert_examples_to_arrays([InputExample('bench-%d' % i, text, label='0')
+                                           for i, (_, text) in enumerate(samples)],
+                                          ['0'], arg_dic['max_seq_length'], tokenizer)
+    batches = [features.take(slice(i, i + args.batch_size)) for i in range(0, len(features), args.batch_size)]
+
+    with tempfile.TemporaryDirectory() as weights_dir:
+        shared = SharedWeights(save_weights(load_graph_def(pb_file), os.path.join(weights_dir, 'w')))
+        print('{} 个常量改为 mmap feed，共 {:.1f} MB；去掉权重后的图 {:.1f} KB'.format(
+            len(shared.arrays), sum(a.nbytes for a in shared.arrays.values()) / 2 ** 20,
+            shared.graph_def.ByteSize() / 1024))
+        predictors = [('常量权重', SessionPredictor.from_pb(pb_file)),
+                      ('mmap feed', SessionPredictor.from_pb(pb_file, shared_weights=shared))]
+        outputs = {}
+        for name, predictor in predictors:
+            predictor.predict(batches[0])  # 预热
+            latencies = []
+            outputs[name] = []
+            for batch in batches:
+                start = time.perf_counter()
+                outputs[name].append(predictor.predict(batch))
+                latencies.append(time.perf_counter() - start)
+            latencies.sort()
+            report(name, sum(latencies), len(features))
+            print('  每批 p50 {:.1f} ms  p90 {:.1f} ms'.format(latencies[len(latencies) // 2] * 1000,
+                                                           latencies[int(len(latencies) * 0.9)] * 1000))
+        for a, b in zip(*outputs.values()):
+            if not np.allclose(a, b, atol=1e-5):
+                raise ValueError('mmap feed 的输出和常量权重不一致')
+        print('两种加载方式的输出一致')
+
+
+def bench_wordpiece(args):
+    """WordPiece：逐词比对前缀树实现和原始实现的输出(同 check_wordpiece.py)，并比较两者的速度。"""
+    import tokenization
+    from arguments import arg_dic
+    from check_wordpiece import find_mismatches
+
+    tokenizer = tokenization.FullTokenizer(vocab_file=arg_dic['vocab_file'], do_lower_case=arg_dic['do_lower_case'])
+    wordpiece = tokenizer.wordpiece_tokenizer
+    files = [args.data] if args.data else sorted(glob.glob('./data/*.txt'))
+    words = []
+    for file_path in files:
+        for _, text in load_samples(file_path, args.limit):
+            words.extend(tokenizer.basic_tokenizer.tokenize(text))
+    print('文件 {}，共 {} 个词，最长 {} 个字符'.format(files, len(words), max(len(w) for w in words)))
+
+    mismatches = find_mismatches(wordpiece, set(words))
+    if mismatches:
+        raise ValueError('%d 个词的切分结果和原始实现不一致，例如 %r' % (len(mismatches), mismatches[:5]))
+    print('切分结果与原始实现完全一致')
+
+    start = time.perf_counter()
+    for w in words:
+        wordpiece.tokenize_reference(w)
+    reference = time.perf_counter() - start
+    report('原始实现', reference, len(words))
+
+    start = time.perf_counter()
+    for w in words:
+        wordpiece.tokenize(w)
+    trie = time.perf_counter() - start
+    report('前缀树', trie, len(words))
+    print('加速 {:.2f}x'.format(reference / trie if trie else 0.0))
+
+
+def bench_convert(args):
+    """特征转换：批量转换成NumPy数组与逐条 convert_single_example 的结果比对和速度对比。"""
+    import numpy as np
+    from train_eval import (arg_dic, tokenization, InputExample, convert_single_example,
+                            convert_examples_to_arrays)
+
+    samples = load_samples(args.data or './data/test.txt', args.limit)
+    max_seq_length = arg_dic['max_seq_length']
+    label_list = sorted(set(label for label, _ in samples))
+    examples = [InputExample('bench-%d' % i, text, label=label) for i, (label, text) in enumerate(samples)]
+    # 两边各用一个不带缓存的分词器，比较的只是转换本身
+    tokenizer = tokenization.FullTokenizer(vocab_file=arg_dic['vocab_file'], do_lower_case=arg_dic['do_lower_case'],
+                                           cache_size=0)
+
+    start = time.perf_counter()
+    features = [convert_single_example(i, e, label_list, max_seq_length, tokenizer) for i, e in enumerate(examples)]
+    single = time.perf_counter() - start
+    report('逐条转换', single, len(examples))
+
+    start = time.perf_counter()
+    arrays = convert_examples_to_arrays(examples, label_list, max_seq_length, tokenizer)
+    batch = time.perf_counter() - start
+    report('批量转换成数组', batch, len(examples))
+    print('加速 {:.2f}x'.format(single / batch if batch else 0.0))
+
+    for name in ('input_ids', 'input_mask', 'segment_ids'):
+        if not np.array_equal(np.array([getattr(f, name) for f in features], dtype=np.int32), getattr(arrays, name)):
+            raise ValueError('%s 和逐条转换的结果不一致' % name)
+    if arrays.label_ids.tolist() != [f.label_id for f in features]:
+        raise ValueError('label_ids 和逐条转换的结果不一致')
+    print('转换结果与逐条转换完全一致')
+
+
+def bench_input(args):
+    """输入流水线：同一批样本分别写成TFRecord和npy特征，比较训练输入函数每秒能产出多少条样本。"""
+    import shutil
+    import tempfile
+    import tensorflow as tf
+    from npy_features import NPY_SUFFIX
+    from train_eval import (arg_dic, tokenization, InputExample, file_based_convert_examples_to_features,
+                            file_based_convert_examples_to_npy, file_based_input_fn_builder, get_length_buckets)
+
+    samples = load_samples(args.data or './data/test.txt', args.limit)
+    max_seq_length = arg_dic['max_seq_length']
+    label_list = sorted(set(label for label, _ in samples))
+    examples = [InputExample('bench-%d' % i, text, label=label) for i, (label, text) in enumerate(samples)]
+    tokenizer = tokenization.FullTokenizer(vocab_file=arg_dic['vocab_file'], do_lower_case=arg_dic['do_lower_case'])
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        tf_record_file = os.path.join(tmp_dir, 'bench.tf_record')
+        file_based_convert_examples_to_features(examples, label_list, max_seq_length, tokenizer, tf_record_file)
+        npy_dir = file_based_convert_examples_to_npy(examples, label_list, max_seq_length, tokenizer,
+                                                     os.path.join(tmp_dir, 'bench' + NPY_SUFFIX))
+        length_buckets = get_length_buckets(max_seq_length)
+        for buckets in ((None, length_buckets) if length_buckets else (None,)):
+            print('长度分桶：{}'.format(buckets or '不分桶'))
+            for name, path in (('TFRecord', tf_record_file), ('npy内存映射', npy_dir)):
+                input_fn = file_based_input_fn_builder(path, max_seq_length, is_training=True, drop_remainder=True,
+                                                       length_buckets=buckets)
+                with tf.Graph().as_default():
+                    next_batch = input_fn({}).make_one_shot_iterator().get_next()
+                    with tf.Session() as sess:
+                        sess.run(next_batch)  # 预热，填满 shuffle 缓冲区
+                        count = 0
+                        start = time.perf_counter()
+                        for _ in range(args.steps):
+                            count += len(sess.run(next_batch)['label_ids'])
+                        report('  ' + name, time.perf_counter() - start, count)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+BENCHMARKS = {
+    'buckets': bench_buckets,
+    'convert': bench_convert,
+    'input': bench_input,
+    'weights': bench_weights,
+    'wordpiece': bench_wordpiece,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='性能基准测试')
+    parser.add_argument('name', choices=sorted(BENCHMARKS))
+    parser.add_argument('--data', default=None, help='"标签\\t文本" 格式的数据文件，默认 data/test.txt（wordpiece 默认 data/*.txt）')
+    parser.add_argument('--limit', type=int, default=None, help='最多使用多少条样本')
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--steps', type=int, default=200, help='input 测试中每种格式读取的批数')
+    args = parser.parse_args()
+    BENCHMARKS[args.name](args)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+'''
+@desc: 服务端的判定结果缓存。同一个文件在不同机器上反复出现时，直接返回上一次的类别和置信度，不再跑BERT。
+'''
+import re
+import time
+import hashlib
+import threading
+import collections
+
+_WHITESPACE = re.compile(r'[ \t\n\r]+')
+
+
+def normalize_text(text):
+    """只合并BERT分词时本来就会被当作分隔符的空白，归一化前后模型看到的token完全一样。"""
+    return _WHITESPACE.sub(' ', text).strip(' ')
+
+
+def content_key(text, model_version=''):
+    """由模型版本和归一化后的文本内容计算缓存键。"""
+    h = hashlib.sha1(model_version.encode('utf-8'))
+    h.update(b'\0')
+    h.update(normalize_text(text).encode('utf-8', 'surrogatepass'))
+    return h.hexdigest()
+
+
+class VerdictCache(object):
+    """Thread-safe LRU cache of (label, score) verdicts with an optional TTL.
+
+    `max_size` bounds the number of entries; the least recently used entry is
+    evicted first. `ttl` is in seconds, 0 disables expiry.
+    """
+
+    def __init__(self, max_size=100000, ttl=0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = collections.OrderedDict()  # key -> (写入时间, 结果)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """Returns the cached verdict or None."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if self.ttl and time.monotonic() - entry[0] > self.ttl:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drops every entry, e.g. after the model has been reloaded."""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+class SingleFlight(object):
+    """Coalesces concurrent requests for the same key onto one in-flight future.
+
+    Works independently of `VerdictCache`: a key is only remembered while its
+    computation is running, so identical submissions arriving at the same time
+    share one forward pass and all receive its result.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, submit):
+        """Returns the pending future for `key`, calling `submit()` to create one if needed.
+
+        `submit` must return a `concurrent.futures.Future`. Exceptions it raises
+        (e.g. `queue.Full`) propagate and nothing is registered.
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future
+            future = submit()
+            self._inflight[key] = future
+            self.leaders += 1
+        future.add_done_callback(lambda f: self._forget(key, f))
+        return future
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def stats(self):
+        with self._lock:
+            return {'inflight': len(self._inflight), 'leaders': self.leaders, 'coalesced': self.coalesced}
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+'''
+@desc: 回归检查：前缀树版 WordPiece 的切分结果必须和原始实现逐词一致。发现不一致时打印例子并以非0状态退出，可以直接放进CI。
+       用法：python check_wordpiece.py               检查 data/*.txt
+             python check_wordpiece.py --data a.txt,b.txt --vocab_file ./vocab.txt
+'''
+import sys
+import glob
+import argparse
+
+import tokenization
+from arguments import arg_dic
+from example_reader import load_samples
+
+
+def collect_words(tokenizer, files, limit=None):
+    """data 文件里经过 BasicTokenizer 之后的所有词(去重)。"""
+    words = set()
+    for file_path in files:
+        for _, text in load_samples(file_path, limit):
+            words.update(tokenizer.basic_tokenizer.tokenize(text))
+    return sorted(words)
+
+
+def find_mismatches(wordpiece, words):
+    """返回 [(词, 前缀树结果, 原始实现结果), ...]。"""
+    mismatches = []
+    for word in words:
+        expected = wordpiece.tokenize_reference(word)
+        actual = wordpiece.tokenize(word)
+        if actual != expected:
+            mismatches.append((word, actual, expected))
+    return mismatches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='检查前缀树版 WordPiece 与原始实现的切分是否一致')
+    parser.add_argument('--data', default=None, help='逗号分隔的 "标签\\t文本" 文件，默认 data/*.txt')
+    parser.add_argument('--vocab_file', default=arg_dic['vocab_file'])
+    parser.add_argument('--limit', type=int, default=None, help='每个文件最多使用多少条样本')
+    args = parser.parse_args()
+
+    files = args.data.split(',') if args.data else sorted(glob.glob('./data/*.txt'))
+    if not files:
+        print('没有找到数据文件')
+        sys.exit(2)
+    tokenizer = tokenization.FullTokenizer(vocab_file=args.vocab_file, do_lower_case=arg_dic['do_lower_case'])
+    words = collect_words(tokenizer, files, args.limit)
+    mismatches = find_mismatches(tokenizer.wordpiece_tokenizer, words)
+    print('文件 {}，共检查 {} 个不同的词'.format(files, len(words)))
+    if mismatches:
+        for word, actual, expected in mismatches[:20]:
+            print('  {!r}: 前缀树 {} != 原始实现 {}'.format(word, actual, expected))
+        print('{} 个词的切分结果和原始实现不一致'.format(len(mismatches)))
+        sys.exit(1)
+    print('切分结果与原始实现完全一致')
@@ -51,10 +51,14 @@ class Config():
         self.do_predict = False
         self.do_eval = True
         self.batch_size = 20
+        self.shuffle_buffer_size = 10000    # 训练时打乱用的缓冲区(条数)
+        self.max_queue_size = 2000    # 预测时排队等待的最大条数，超过后 submit 抛 queue.Full
         self.learning_rate = 5e-5
         self.num_train_epochs = 3.0
         self.warmup_proportion = 0.1
         self.save_checkpoints_steps = 100
         self.iterations_per_loop = 1000
+        self.feature_workers = 0    # 写TFRecord特征时的进程数，0 表示使用全部CPU核，1 表示串行
+        self.feature_format = 'tfrecord'    # 特征存储格式：tfrecord 或 npy(内存映射的定长矩阵)
         self.n_best_size = 20
         self.max_answer_length = 30
@@ -13,18 +13,22 @@
 
 '''
 
-import os, csv, random, collections, pickle
+import os, csv, random, collections, pickle, itertools
 import tensorflow as tf
 import numpy as np
 import pickle as pkl
 import pathlib
 
-from queue import Queue
-from threading import Thread
+from queue import Queue, Empty, Full
+from threading import Thread, Lock
+from concurrent.futures import Future
 import modeling
 import optimization
 import tokenization
 from config import Config
+from parallel_features import is_manifest, read_manifest, resolve_num_workers, parallel_convert_examples_to_features
+from example_reader import index_file, LineExamples
+from npy_features import NPY_SUFFIX, resolve_npy_features, stack_features, write_npy_features, npy_dataset
 
 
 os.environ['CUDA_VISIBLE_DEVICES'] = '1'
@@ -99,56 +103,26 @@ class DomainProcessor(DataProcessor):
 
     def get_train_examples(self, data_dir):
         file_path = os.path.join(data_dir, 'train.txt')
-        with open(file_path, 'r', encoding="utf-8") as f:
-            reader = f.readlines()
         random.seed(0)
-        random.shuffle(reader)  # 注意要shuffle
-
-        examples, self.labels = [], []
-        for index, line in enumerate(reader):
-            guid = 'train-%d' % index
-            split_line = line.strip().split("\t")
-            text_a = tokenization.convert_to_unicode(split_line[1])
-            text_b = None
-            label = split_line[0]
-            examples.append(InputExample(guid=guid, text_a=text_a,
-                                         text_b=text_b, label=label))
-            self.labels.append(label)
-        return examples
+        offsets, self.labels = index_file(file_path, shuffle=True, collect_labels=True)  # 注意要shuffle
+        return LineExamples(file_path, offsets, self.create_example, 'train')
 
     def get_dev_examples(self, data_dir):
         file_path = os.path.join(data_dir, 'val.txt')
-        with open(file_path, 'r', encoding="utf-8") as f:
-            reader = f.readlines()
-        random.shuffle(reader)
-
-        examples = []
-        for index, line in enumerate(reader):
-            guid = 'dev-%d' % index
-            split_line = line.strip().split('\t')
-            text_a = tokenization.convert_to_unicode(split_line[1])
-            text_b = None
-            label = split_line[0]
-            examples.append(InputExample(guid=guid, text_a=text_a,
-                                         text_b=text_b, label=label))
-        return examples
+        offsets, _ = index_file(file_path, shuffle=True)
+        return LineExamples(file_path, offsets, self.create_example, 'dev')
 
     def get_test_examples(self, data_dir):
         file_path = os.path.join(data_dir, 'cnews.test.txt')
-        with open(file_path, 'r', encoding="utf-8") as f:
-            reader = f.readlines()
-        # random.shuffle(reader)  # 测试集不打乱数据，便于比较
-
-        examples = []
-        for index, line in enumerate(reader):
-            guid = 'test-%d' % index
-            split_line = line.strip().split("\t")
-            text_a = tokenization.convert_to_unicode(split_line[1])
-            text_b = None
-            label = split_line[0]
-            examples.append(InputExample(guid=guid, text_a=text_a,
-                                         text_b=text_b, label=label))
-        return examples
+        offsets, _ = index_file(file_path)  # 测试集不打乱数据，便于比较
+        return LineExamples(file_path, offsets, self.create_example, 'test')
+
+    def create_example(self, line, guid):
+        split_line = line.strip().split("\t")
+        text_a = tokenization.convert_to_unicode(split_line[1])
+        text_b = None
+        label = split_line[0]
+        return InputExample(guid=guid, text_a=text_a, text_b=text_b, label=label)
 
     def get_sentence_examples(self, questions):
         for index, data in enumerate(questions):
@@ -183,8 +157,13 @@ class DomainCLS():
         self.mode = mode
         self.estimator = self.get_estimator()
         if mode == tf.estimator.ModeKeys.PREDICT:
-            self.input_queue = Queue(maxsize=1)
-            self.output_queue = Queue(maxsize=1)
+            self.label_list = self.get_label_list()
+            self.input_queue = Queue(maxsize=cf.max_queue_size)    # (请求id, 句子)，排满后 submit 直接抛 queue.Full，不会无限堆积
+            self.batch_ids = collections.deque()    # 已经送进模型的各个batch的请求id，按先后顺序排列
+            self.futures = {}    # 请求id -> Future
+            self.futures_lock = Lock()
+            self.request_ids = itertools.count()
+            self.predict_error = None    # 预测线程连续失败、不再重启时记下原因，之后的 submit 直接报错
             self.predict_thread = Thread(target=self.predict_from_queue, daemon=True)    #daemon守护进程
             self.predict_thread.start()
 
@@ -336,8 +315,41 @@ class DomainCLS():
         return label_list
 
     def predict_from_queue(self):
-        for i in self.estimator.predict(input_fn=self.queue_predict_input_fn, yield_single_examples=False):
-            self.output_queue.put(i)
+        # estimator.predict 出错(图错误、OOM等)时让所有在途的请求立即失败并重启预测；
+        # 重启后一批都没算成就又失败，说明模型本身有问题，不再重启，之后的 submit 直接报错
+        failures = 0
+        while True:
+            try:
+                # estimator按batch送进去的顺序输出结果，所以每个输出对应 batch_ids 里最早的那一组请求
+                for i in self.estimator.predict(input_fn=self.queue_predict_input_fn, yield_single_examples=False):
+                    failures = 0
+                    ids = self.batch_ids.popleft()
+                    for request_id, probabilities in zip(ids, i['probabilities']):
+                        with self.futures_lock:
+                            future = self.futures.pop(request_id, None)
+                        if future is not None:
+                            future.set_result(probabilities)
+            except Exception as e:
+                failures += 1
+                tf.compat.v1.logging.error('预测线程出错(第%d次): %s', failures, e)
+                if failures >= 2:
+                    self.predict_error = e
+                self.fail_pending(e)
+                if self.predict_error is not None:
+                    return
+
+    def fail_pending(self, error):
+        """让所有还没出结果的请求(包括还在排队的)以 error 失败。"""
+        while True:
+            try:
+                self.input_queue.get_nowait()
+            except Empty:
+                break
+        self.batch_ids.clear()
+        with self.futures_lock:
+            futures, self.futures = self.futures, {}
+        for future in futures.values():
+            future.set_exception(error)
 
     def queue_predict_input_fn(self):
         return (tf.data.Dataset.from_generator(
@@ -351,16 +363,33 @@ class DomainCLS():
                 'input_ids': (None, self.max_seq_length),
                 'input_mask': (None, self.max_seq_length),
                 'segment_ids': (None, self.max_seq_length),
-                'label_ids': (1,)}).prefetch(10))
+                'label_ids': (None,)}).prefetch(10))
 
     def generate_from_queue(self):
         while True:
-            predict_examples = self.processor.get_sentence_examples(self.input_queue.get())
-
-            features = list(self.convert_examples_to_features(predict_examples,
-                                                              self.processor.get_labels(),
-                                                              cf.max_seq_length,
-                                                              self.tokenizer))
+            # 阻塞等待第一个请求，再把此刻已经在排队的请求一并取出，凑成一个batch
+            requests = [self.input_queue.get()]
+            while len(requests) < self.batch_size:
+                try:
+                    requests.append(self.input_queue.get_nowait())
+                except Empty:
+                    break
+            ids = [request_id for request_id, _ in requests]
+            try:
+                predict_examples = self.processor.get_sentence_examples([sentence for _, sentence in requests])
+                features = list(self.convert_examples_to_features(predict_examples,
+                                                                  self.processor.get_labels(),
+                                                                  cf.max_seq_length,
+                                                                  self.tokenizer))
+            except Exception as e:
+                # 特征转换出错只影响这一批请求，生成器本身不能退出，否则后面的预测全部卡住
+                for request_id in ids:
+                    with self.futures_lock:
+                        future = self.futures.pop(request_id, None)
+                    if future is not None:
+                        future.set_exception(e)
+                continue
+            self.batch_ids.append(ids)
             yield {
                 'input_ids': [f.input_ids for f in features],
                 'input_mask': [f.input_mask for f in features],
@@ -376,10 +405,11 @@ class DomainCLS():
             for (i, label) in enumerate(label_list):
                 label_map[label] = i
 
-            tokens_a = tokenizer.tokenize(example.text_a)
+            # 分词达到预算就停下，和 train_eval.convert_single_example 一样
             tokens_b = None
             if example.text_b:
-                tokens_b = tokenizer.tokenize(example.text_b)
+                tokens_b = tokenizer.tokenize(example.text_b, max_tokens=max_seq_length - 3)
+            tokens_a = tokenizer.tokenize(example.text_a, max_tokens=max_seq_length - (3 if tokens_b else 2))
 
             if tokens_b:
                 # Modifies `tokens_a` and `tokens_b` in place so that the total
@@ -465,10 +495,10 @@ class DomainCLS():
         for (i, label) in enumerate(label_list):
             label_map[label] = i
 
-        tokens_a = tokenizer.tokenize(example.text_a)
         tokens_b = None
         if example.text_b:
-            tokens_b = tokenizer.tokenize(example.text_b)
+            tokens_b = tokenizer.tokenize(example.text_b, max_tokens=max_seq_length - 3)
+        tokens_a = tokenizer.tokenize(example.text_a, max_tokens=max_seq_length - (3 if tokens_b else 2))
 
         if tokens_b:
             # Modifies `tokens_a` and `tokens_b` in place so that the total
@@ -559,10 +589,35 @@ class DomainCLS():
             writer.write(tf_example.SerializeToString())
         writer.close()
 
+    def write_features(self, examples, label_list, output_file):
+        '''
+        按 cf.feature_format、cf.feature_workers 写特征
+        :return: 交给 file_based_input_fn_builder 的路径，npy 格式是特征目录，TFRecord 多进程时是分片清单文件
+        '''
+        if cf.feature_format == 'npy':
+            features = self.convert_examples_to_features(examples, label_list, cf.max_seq_length, self.tokenizer)
+            batches = iter(lambda: list(itertools.islice(features, 10000)), [])
+            return write_npy_features(os.path.splitext(output_file)[0] + NPY_SUFFIX, len(examples), cf.max_seq_length,
+                                      (stack_features(batch) for batch in batches))
+        if cf.feature_format != 'tfrecord':
+            raise ValueError("Unknown feature_format: %s" % cf.feature_format)
+        if resolve_num_workers(cf.feature_workers) <= 1:
+            self.file_based_convert_examples_to_features(examples, label_list, cf.max_seq_length, self.tokenizer,
+                                                         output_file)
+            return output_file
+        return parallel_convert_examples_to_features(examples, label_list, cf.max_seq_length, cf.vocab_file, True,
+                                                     output_file, cf.feature_workers)
 
     def file_based_input_fn_builder(self, input_file, seq_length, is_training,
                                     drop_remainder):
-        """Creates an `input_fn` closure to be passed to TPUEstimator."""
+        """Creates an `input_fn` closure to be passed to TPUEstimator.
+
+        Records are batched first and decoded a whole batch at a time with
+        `tf.parse_example` on autotuned parallel map calls, then prefetched.
+        `input_file` may also be a .npy feature directory (cf.feature_format = 'npy').
+        """
+        npy_path = resolve_npy_features(input_file)
+        autotune = tf.data.experimental.AUTOTUNE
 
         name_to_features = {
             "input_ids": tf.io.FixedLenFeature([seq_length], tf.int64),
@@ -572,9 +627,9 @@ class DomainCLS():
             "is_real_example": tf.io.FixedLenFeature([], tf.int64),
         }
 
-        def _decode_record(record, name_to_features):
-            """Decodes a record to a TensorFlow example."""
-            example = tf.parse_single_example(record, name_to_features)
+        def _decode_batch(records):
+            """Decodes a batch of serialized records into int32 tensors."""
+            example = tf.io.parse_example(records, name_to_features)
 
             # tf.Example only supports tf.int64, but the TPU only supports tf.int32.
             # So cast all int64 to int32.
@@ -590,19 +645,30 @@ class DomainCLS():
             """The actual input function."""
             batch_size = params["batch_size"]
 
+            if npy_path:
+                return npy_dataset(npy_path, batch_size, is_training, drop_remainder)
+
             # For training, we want a lot of parallel reading and shuffling.
             # For eval, we want no shuffling and parallel reading doesn't matter.
-            d = tf.data.TFRecordDataset(input_file)
+            if is_manifest(input_file):
+                # 多进程写出的分片：训练时并行交错读取，否则按清单顺序读，保证和样本顺序一致
+                shards = read_manifest(input_file)
+                if is_training:
+                    d = tf.data.Dataset.from_tensor_slices(tf.constant(shards))
+                    d = d.shuffle(buffer_size=len(shards)).repeat()
+                    d = d.interleave(tf.data.TFRecordDataset, cycle_length=len(shards), num_parallel_calls=autotune)
+                else:
+                    d = tf.data.TFRecordDataset(shards)
+            else:
+                d = tf.data.TFRecordDataset(input_file)
+                if is_training:
+                    d = d.repeat()
             if is_training:
-                d = d.repeat()
-                d = d.shuffle(buffer_size=100)
+                d = d.shuffle(buffer_size=cf.shuffle_buffer_size)
 
-            d = d.apply(
-                tf.data.experimental.map_and_batch(
-                    lambda record: _decode_record(record, name_to_features),
-                    batch_size=batch_size,
-                    drop_remainder=drop_remainder))
-            return d
+            d = d.batch(batch_size, drop_remainder=drop_remainder)
+            d = d.map(_decode_batch, num_parallel_calls=autotune)
+            return d.prefetch(autotune)
 
         return input_fn
 
@@ -701,8 +767,8 @@ class DomainCLS():
             pb_file = os.path.join(cf.pb_model_dir, 'classification_model.pb')
             graph = tf.Graph()
             with graph.as_default():
-                input_ids = tf.placeholder(tf.int32, (None, cf.max_seq_length), 'input_ids')
-                input_mask = tf.placeholder(tf.int32, (None, cf.max_seq_length), 'input_mask')
+                input_ids = tf.placeholder(tf.int32, (None, None), 'input_ids')
+                input_mask = tf.placeholder(tf.int32, (None, None), 'input_mask')
                 bert_config = modeling.BertConfig.from_json_file(cf.bert_config_file)
                 loss, per_example_loss, logits, probabilities = self.create_classification_model(
                     bert_config=bert_config,
@@ -762,9 +828,7 @@ class DomainCLS():
 
         estimator = self.get_estimator()
 
-        train_file = os.path.join(cf.output_dir, "train.tf_record")
-        self.file_based_convert_examples_to_features(train_examples, label_list, cf.max_seq_length, self.tokenizer,
-                                                     train_file)
+        train_file = self.write_features(train_examples, label_list, os.path.join(cf.output_dir, "train.tf_record"))
         tf.compat.v1.logging.info("***** Running training *****")
         tf.compat.v1.logging.info("  Num examples = %d", len(train_examples))
         tf.compat.v1.logging.info("  Batch size = %d", cf.batch_size)
@@ -787,10 +851,8 @@ class DomainCLS():
         if self.mode is None:
             raise ValueError("Please set the 'mode' parameter")
         eval_examples = self.processor.get_dev_examples(cf.data_dir)
-        eval_file = os.path.join(cf.output_dir, "eval.tf_record")
         label_list = self.processor.get_labels()
-        self.file_based_convert_examples_to_features(
-            eval_examples, label_list, cf.max_seq_length, self.tokenizer, eval_file)
+        eval_file = self.write_features(eval_examples, label_list, os.path.join(cf.output_dir, "eval.tf_record"))
 
         tf.compat.v1.logging.info("***** Running evaluation *****")
         tf.compat.v1.logging.info("  Num examples = %d", len(eval_examples))
@@ -818,12 +880,31 @@ class DomainCLS():
         :param sentence:
         :return:
         '''
+        probabilities = self.submit(sentence).result()
+        return self.label_list[int(np.argmax(probabilities))]
+
+    def submit(self, sentence):
+        '''
+        提交一条待预测的句子，立即返回 Future，结果是该句子的概率向量。可以被多个线程同时调用。
+        排队的请求已满时抛出 queue.Full；预测线程已经停止时抛出 RuntimeError
+        :param sentence:
+        :return:
+        '''
         if self.mode is None:
             raise ValueError("Please set the 'mode' parameter")
-        self.input_queue.put([sentence])
-        label = self.get_label_list()
-        prediction = label[int(np.argmax(self.output_queue.get()['probabilities']))]
-        return prediction
+        if self.predict_error is not None:
+            raise RuntimeError('prediction thread stopped: %s' % self.predict_error)
+        future = Future()
+        request_id = next(self.request_ids)
+        with self.futures_lock:
+            self.futures[request_id] = future
+        try:
+            self.input_queue.put_nowait((request_id, sentence))
+        except Full:
+            with self.futures_lock:
+                self.futures.pop(request_id, None)
+            raise
+        return future
 
 
     # save_PBmodel(len(label_list))  # 生成单个pb模型。
@@ -833,8 +914,8 @@ if __name__ == '__main__':
     cls.set_mode(tf.estimator.ModeKeys.PREDICT)
     testcase = ['中国高铁动车组通常运行速度是多少？', '中国高铁动车组通常运行速度是多少？', '梨树种下之后，过几年能结果子？', '青蛙在吃虫子时眼睛是怎样的状态？']
     for sentence in testcase:
-        atime = time.clock()
+        atime = time.perf_counter()
         y = cls.predict(sentence)
-        btime=time.clock()
+        btime=time.perf_counter()
         print(y)
         print(btime-atime)
\ No newline at end of file
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+'''
+@desc: 按行流式读取 "标签\t文本" 数据文件。先扫一遍文件记下每行的字节偏移(打乱时只打乱偏移)，
+       样本在遍历时才按偏移读出来，内存里不再同时放着全部原始行和全部 InputExample。
+       load_samples 是一次读入 (标签, 文本) 的小工具，供基准测试、压测和词表工具使用。
+'''
+import random
+from array import array
+
+
+def load_samples(file_path, limit=None):
+    """读取 "标签\\t文本" 格式的数据文件，返回 [(标签, 文本), ...]。"""
+    samples = []
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            split_line = line.strip().split('\t')
+            if len(split_line) < 2:
+                continue
+            samples.append((split_line[0], split_line[1]))
+            if limit and len(samples) >= limit:
+                break
+    return samples
+
+
+def index_file(file_path, shuffle=False, collect_labels=False):
+    """扫描文件，返回 (每行起始字节偏移, 标签列表)。
+
+    shuffle 为 True 时用全局的 random.shuffle 打乱偏移：打乱只和行数有关，
+    所以与先 readlines() 再 random.shuffle 得到的顺序完全一样，调用方之前的 random.seed 依然有效。
+    collect_labels 为 True 时按打乱后的顺序返回去重的标签(首次出现的先后)，否则标签列表为空。
+    """
+    offsets = array('Q')
+    line_labels = array('I')
+    label_codes = {}
+    position = 0
+    with open(file_path, 'rb') as f:
+        for line in f:
+            offsets.append(position)
+            position += len(line)
+            if collect_labels:
+                label = line.decode('utf-8').strip().split('\t', 1)[0]
+                line_labels.append(label_codes.setdefault(label, len(label_codes)))
+
+    order = array('I', range(len(offsets)))
+    if shuffle:
+        random.shuffle(order)
+        offsets = array('Q', (offsets[i] for i in order))
+
+    labels = []
+    if collect_labels:
+        names = sorted(label_codes, key=label_codes.get)
+        seen = set()
+        for i in order:
+            code = line_labels[i]
+            if code not in seen:
+                seen.add(code)
+                labels.append(names[code])
+                if len(seen) == len(names):
+                    break
+    return offsets, labels
+
+
+class LineExamples(object):
+    """Examples read lazily from `file_path` in the order given by `offsets`.
+
+    Supports `len`, iteration, integer indexing and contiguous slicing, which
+    is all the feature writers need. `parse(line, guid)` turns one raw line
+    into an example; guids are `"<set_type>-<position>"` as with the old
+    in-memory lists.
+    """
+
+    def __init__(self, file_path, offsets, parse, set_type, start=0):
+        self.file_path = file_path
+        self.offsets = offsets
+        self.parse = parse
+        self.set_type = set_type
+        self.start = start
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self.offsets))
+            if step != 1:
+                raise ValueError('LineExamples only supports contiguous slices')
+            return LineExamples(self.file_path, self.offsets[start:stop], self.parse, self.set_type,
+                                self.start + start)
+        if item < 0:
+            item += len(self.offsets)
+        if not 0 <= item < len(self.offsets):
+            raise IndexError(item)
+        with open(self.file_path, 'rb') as f:
+            return self._read(f, item)
+
+    def __iter__(self):
+        with open(self.file_path, 'rb') as f:
+            for i in range(len(self.offsets)):
+                yield self._read(f, i)
+
+    def _read(self, f, i):
+        f.seek(self.offsets[i])
+        line = f.readline().decode('utf-8')
+        return self.parse(line, '%s-%d' % (self.set_type, self.start + i))
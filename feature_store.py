@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+'''
+@desc: 按内容寻址的特征缓存。数据文件、词表、是否小写、max_seq_length、标签列表都没变时直接复用上次写好的TFRecord，
+       不再重新分词；增量模式下数据文件只是在末尾追加了若干行时，只转换新增的行，作为新的分片加进清单。
+'''
+import io
+import os
+import json
+import shutil
+import hashlib
+
+import tensorflow as tf
+
+from parallel_features import is_manifest
+
+FORMAT_VERSION = 1  # 特征的写法变了(例如换了分词逻辑)就加一，让旧缓存全部失效
+
+
+def file_sha1(file_path):
+    h = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def read_lines(data):
+    """只按 \\n 切分字节串并逐行解码，和 example_reader.index_file 建索引时的分行方式一致。"""
+    return [line.decode('utf-8') for line in io.BytesIO(data)]
+
+
+def scan_source(file_path, prefix_bytes=None):
+    """流式扫描一遍文件，返回 {'bytes', 'sha1', 'lines', 'prefix_sha1', 'prefix_newline'}。
+
+    lines 按 index_file 的规则计数(每个 \\n 一行，末尾没有换行的残行也算一行)；给了 prefix_bytes 时，
+    顺便算出前 prefix_bytes 个字节的sha1以及这一段是否以换行结尾，文件比它短时 prefix_sha1 为 None。
+    """
+    h = hashlib.sha1()
+    size, num_lines, last = 0, 0, b''
+    prefix_sha1, prefix_newline = None, False
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            if prefix_bytes is not None and size <= prefix_bytes <= size + len(block) and prefix_sha1 is None:
+                cut = prefix_bytes - size
+                h.update(block[:cut])
+                num_lines += block[:cut].count(b'\n')
+                prefix_sha1 = h.hexdigest()
+                last = block[:cut] or last
+                prefix_newline = last[-1:] == b'\n'
+                block = block[cut:]
+                size += cut
+            h.update(block)
+            num_lines += block.count(b'\n')
+            size += len(block)
+            last = block or last
+    if prefix_bytes == 0:
+        prefix_sha1, prefix_newline = hashlib.sha1().hexdigest(), True
+    if last and not last.endswith(b'\n'):
+        num_lines += 1
+    return {'bytes': size, 'sha1': h.hexdigest(), 'lines': num_lines,
+            'prefix_sha1': prefix_sha1, 'prefix_newline': prefix_newline}
+
+
+def read_range(file_path, start, end):
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start)
+
+
+class FeatureStore(object):
+    """Caches converted TFRecord features under a key of everything that affects them.
+
+    The directory is keyed by (vocab content, do_lower_case, max_seq_length,
+    label list, feature format); inside it, a manifest records which bytes of the source file
+    the records were built from. `get_or_build` then either reuses the
+    records, converts only lines appended since, or rebuilds from scratch.
+    """
+
+    def __init__(self, cache_dir, vocab_file, do_lower_case, max_seq_length, label_list, feature_format='tfrecord'):
+        self.cache_dir = cache_dir
+        h = hashlib.sha1()
+        h.update(json.dumps({'format': FORMAT_VERSION, 'vocab': file_sha1(vocab_file),
+                             'do_lower_case': bool(do_lower_case), 'max_seq_length': max_seq_length,
+                             'labels': list(label_list), 'feature_format': feature_format},
+                            sort_keys=True, ensure_ascii=False).encode('utf-8'))
+        self.key = h.hexdigest()
+
+    def entry_dir(self, name):
+        return os.path.join(self.cache_dir, '%s-%s' % (name, self.key[:16]))
+
+    def get_or_build(self, name, source_file, write_all, write_lines, incremental=False):
+        """Returns a manifest of features for `source_file`, converting as little as possible.
+
+        Args:
+          name: Cache entry name, e.g. "train".
+          source_file: The data file the features are built from.
+          write_all: `write_all(output_file)` converts the whole file and returns
+            the path it wrote (a TFRecord file or a shard manifest).
+          write_lines: `write_lines(lines, first_index, output_file)` converts
+            only `lines` (decoded, in file order) and returns the path it wrote.
+          incremental: Whether lines appended to `source_file` may be added to
+            existing records instead of rebuilding everything.
+        """
+        entry_dir = self.entry_dir(name)
+        manifest_file = os.path.join(entry_dir, name + '.manifest')
+        manifest = None
+        if os.path.exists(manifest_file):
+            with open(manifest_file, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+
+        # 只流式扫描一遍文件算哈希和行数，不把整个文件读进内存；增量更新时只读取扫描时看到的新追加部分，
+        # 之后又追加的行留给下一次，不会记进这次的哈希
+        source = manifest['source'] if manifest is not None else None
+        scanned = scan_source(source_file, source['bytes'] if source is not None else None)
+        if source is not None and scanned['prefix_sha1'] == source['sha1']:
+            if scanned['bytes'] == source['bytes']:
+                tf.logging.info('特征缓存命中：%s 未变化，复用 %s' % (source_file, manifest_file))
+                return manifest_file
+            if incremental and scanned['prefix_newline']:
+                lines = read_lines(read_range(source_file, source['bytes'], scanned['bytes']))
+                tf.logging.info('特征缓存增量更新：%s 新增 %d 行' % (source_file, len(lines)))
+                written = write_lines(lines, source['lines'],
+                                      os.path.join(entry_dir, 'append-%05d.tf_record' % len(manifest['shards'])))
+                manifest['shards'].extend(self._shards_of(written, len(lines)))
+                manifest['num_examples'] += len(lines)
+                manifest['source'] = self._source_info(source_file, scanned)
+                self._write_manifest(manifest_file, manifest)
+                return manifest_file
+
+        tf.logging.info('特征缓存未命中：重新转换 %s' % source_file)
+        if os.path.isdir(entry_dir):
+            for file_name in os.listdir(entry_dir):
+                path = os.path.join(entry_dir, file_name)
+                if os.path.isdir(path):
+                    shutil.rmtree(path)  # npy 格式的特征是一个目录
+                else:
+                    os.remove(path)
+        else:
+            os.makedirs(entry_dir)
+        written = write_all(os.path.join(entry_dir, 'records.tf_record'))
+        shards = self._shards_of(written, scanned['lines'])
+        manifest = {
+            'key': self.key,
+            'num_examples': sum(shard['num_examples'] for shard in shards),
+            'shards': shards,
+            'source': self._source_info(source_file, scanned),
+        }
+        self._write_manifest(manifest_file, manifest)
+        return manifest_file
+
+    @staticmethod
+    def _shards_of(written, num_examples):
+        if is_manifest(written):
+            with open(written, 'r', encoding='utf-8') as f:
+                return json.load(f)['shards']
+        return [{'file': os.path.basename(written), 'num_examples': num_examples}]
+
+    @staticmethod
+    def _source_info(source_file, scanned):
+        return {'file': os.path.abspath(source_file), 'bytes': scanned['bytes'], 'sha1': scanned['sha1'],
+                'lines': scanned['lines']}
+
+    @staticmethod
+    def _write_manifest(manifest_file, manifest):
+        # 先写临时文件再替换，中途被打断也不会留下一个看起来有效的清单
+        tmp_file = manifest_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, manifest_file)
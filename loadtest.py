@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+'''
+@desc: server.py 的压测脚本。回放录制的请求(JSONL)或者从 data/test.txt 取样，按固定速率或固定并发发请求，
+       统计吞吐、延迟分位数、错误率，并找出服务的饱和点。结果可以保存成JSON基线，之后改了批处理、缓存或模型再来对比。
+       用法：python loadtest.py --rates 20,50,100,200 --duration 30 --save baseline.json
+             python loadtest.py --concurrency 1,4,16,64 --compare baseline.json
+'''
+import json
+import time
+import random
+import argparse
+import platform
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from example_reader import load_samples
+
+
+def load_replay(file_path):
+    """读取录制的请求，每行一个JSON对象，文本放在 question 或 text 字段里。"""
+    texts = []
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            text = record.get('question') or record.get('text')
+            if text:
+                texts.append(text)
+    return texts
+
+
+def send(url, text, timeout):
+    """发送一条请求，返回 (是否成功, HTTP状态码)。"""
+    data = urllib.parse.urlencode({'user_id': 'loadtest', 'question': text}).encode('utf-8')
+    try:
+        with urllib.request.urlopen(url, data=data, timeout=timeout) as resp:
+            body = json.loads(resp.read().decode('utf-8'))
+            return 'Type' in body, resp.status
+    except urllib.error.HTTPError as e:
+        return False, e.code
+    except Exception:
+        return False, 0
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+class StepRecorder(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.errors = 0
+        self.status = {}
+
+    def record(self, ok, status, latency):
+        with self._lock:
+            self.latencies.append(latency)
+            self.status[status] = self.status.get(status, 0) + 1
+            if not ok:
+                self.errors += 1
+
+    def summary(self, mode, target, elapsed):
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        return {
+            'mode': mode,
+            'target': target,
+            'requests': count,
+            'errors': self.errors,
+            'error_rate': self.errors / count if count else 0.0,
+            'throughput': (count - self.errors) / elapsed if elapsed else 0.0,
+            'latency_ms': {'p50': percentile(latencies, 0.5) * 1000.0, 'p90': percentile(latencies, 0.9) * 1000.0,
+                           'p99': percentile(latencies, 0.99) * 1000.0,
+                           'max': (latencies[-1] if latencies else 0.0) * 1000.0},
+            'status': {str(k): v for k, v in sorted(self.status.items())},
+        }
+
+
+def run_rate(url, texts, rate, duration, timeout, max_inflight):
+    """开环压测：按固定速率发请求，不管之前的请求有没有返回。
+
+    延迟从请求“应该发出”的时刻算起，客户端线程不够用时排队的时间也计入延迟，
+    这样服务变慢时不会因为发得少了而显得延迟还不错。
+    """
+    recorder = StepRecorder()
+    interval = 1.0 / rate
+    total = int(rate * duration)
+
+    def task(text, scheduled):
+        ok, status = send(url, text, timeout)
+        recorder.record(ok, status, time.perf_counter() - scheduled)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_inflight) as pool:
+        for i in range(total):
+            scheduled = start + i * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(task, texts[i % len(texts)], scheduled)
+    return recorder.summary('rate', rate, time.perf_counter() - start)
+
+
+def run_concurrency(url, texts, concurrency, duration, timeout):
+    """闭环压测：固定 concurrency 个客户端，每个收到响应后立即发下一条。"""
+    recorder = StepRecorder()
+    counter = iter(range(1 << 62))
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        while time.perf_counter() < deadline:
+            with lock:
+                i = next(counter)
+            start = time.perf_counter()
+            ok, status = send(url, texts[i % len(texts)], timeout)
+            recorder.record(ok, status, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return recorder.summary('concurrency', concurrency, time.perf_counter() - start)
+
+
+def find_saturation(steps, slo_ms, max_error_rate):
+    """饱和点：最后一个仍然满足要求的档位。
+
+    要求是 p99 不超过 slo_ms、错误率不超过 max_error_rate；按速率压测时，实际吞吐还不能低于目标速率的90%。
+    """
+    best = None
+    for step in steps:
+        ok = step['latency_ms']['p99'] <= slo_ms and step['error_rate'] <= max_error_rate
+        if step['mode'] == 'rate':
+            ok = ok and step['throughput'] >= 0.9 * step['target']
+        if not ok:
+            break
+        best = step
+    return best
+
+
+def print_steps(steps):
+    print('{:<12s} {:>8s} {:>9s} {:>8s} {:>9s} {:>9s} {:>9s} {:>9s}'.format(
+        '档位', '请求数', '吞吐/秒', '错误率', 'p50(ms)', 'p90(ms)', 'p99(ms)', 'max(ms)'))
+    for s in steps:
+        lat = s['latency_ms']
+        print('{:<12s} {:>8d} {:>9.1f} {:>8.2%} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}'.format(
+            '%s=%g' % (s['mode'], s['target']), s['requests'], s['throughput'], s['error_rate'],
+            lat['p50'], lat['p90'], lat['p99'], lat['max']))
+
+
+def compare(result, baseline):
+    """按档位逐个对比吞吐和p99，只比较两次都跑过的档位。"""
+    old_steps = {(s['mode'], s['target']): s for s in baseline['steps']}
+    print('与基线 {} 对比：'.format(baseline.get('created', '')))
+    for step in result['steps']:
+        old = old_steps.get((step['mode'], step['target']))
+        if old is None:
+            continue
+        print('  {}={:g}: 吞吐 {:.1f} -> {:.1f} ({:+.1%})，p99 {:.1f} -> {:.1f} ms ({:+.1%})'.format(
+            step['mode'], step['target'], old['throughput'], step['throughput'],
+            step['throughput'] / old['throughput'] - 1 if old['throughput'] else 0.0,
+            old['latency_ms']['p99'], step['latency_ms']['p99'],
+            step['latency_ms']['p99'] / old['latency_ms']['p99'] - 1 if old['latency_ms']['p99'] else 0.0))
+    old_sat, new_sat = baseline.get('saturation'), result.get('saturation')
+    fmt = lambda sat: '%s=%g' % (sat['mode'], sat['target']) if sat else '无'
+    print('  饱和点：{} -> {}'.format(fmt(old_sat), fmt(new_sat)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='server.py 压测')
+    parser.add_argument('--url', default='http://127.0.0.1:5400/')
+    parser.add_argument('--replay', default=None, help='录制的请求，每行一个含 question 或 text 字段的JSON')
+    parser.add_argument('--data', default='./data/test.txt', help='没有指定 --replay 时从这个文件取样')
+    parser.add_argument('--limit', type=int, default=None, help='最多使用多少条样本')
+    parser.add_argument('--rates', default=None, help='开环压测的请求速率，逗号分隔，例如 10,50,100')
+    parser.add_argument('--concurrency', default=None, help='闭环压测的并发数，逗号分隔，例如 1,8,32')
+    parser.add_argument('--duration', type=float, default=30.0, help='每个档位持续的秒数')
+    parser.add_argument('--warmup', type=float, default=5.0, help='正式开始前用最小档位预热的秒数')
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--max_inflight', type=int, default=512, help='开环压测时客户端最多同时在途的请求数')
+    parser.add_argument('--slo_ms', type=float, default=1000.0, help='判断饱和点用的p99上限')
+    parser.add_argument('--max_error_rate', type=float, default=0.01)
+    parser.add_argument('--shuffle', action='store_true', help='打乱样本顺序(固定随机种子)')
+    parser.add_argument('--save', default=None, help='把结果保存成JSON基线')
+    parser.add_argument('--compare', default=None, help='和之前保存的JSON基线对比')
+    args = parser.parse_args()
+
+    if args.replay:
+        texts = load_replay(args.replay)[:args.limit]
+    else:
+        texts = [text for _, text in load_samples(args.data, args.limit)]
+    if not texts:
+        raise ValueError('没有可用的样本')
+    if args.shuffle:
+        random.Random(0).shuffle(texts)
+    if bool(args.rates) == bool(args.concurrency):
+        raise ValueError('--rates 和 --concurrency 必须且只能指定一个')
+
+    if args.rates:
+        targets = [float(x) for x in args.rates.split(',')]
+        run = lambda target, duration: run_rate(args.url, texts, target, duration, args.timeout, args.max_inflight)
+    else:
+        targets = [int(x) for x in args.concurrency.split(',')]
+        run = lambda target, duration: run_concurrency(args.url, texts, target, duration, args.timeout)
+
+    if args.warmup > 0:
+        run(targets[0], args.warmup)
+    steps = []
+    for target in targets:
+        steps.append(run(target, args.duration))
+        print_steps(steps[-1:])
+    saturation = find_saturation(steps, args.slo_ms, args.max_error_rate)
+
+    print()
+    print_steps(steps)
+    if saturation:
+        print('饱和点：{}={:g}，吞吐 {:.1f}/秒，p99 {:.1f} ms'.format(
+            saturation['mode'], saturation['target'], saturation['throughput'], saturation['latency_ms']['p99']))
+    else:
+        print('最小档位就已经不满足 p99<={}ms、错误率<={:.1%} 的要求'.format(args.slo_ms, args.max_error_rate))
+
+    result = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'host': platform.node(),
+        'url': args.url,
+        'source': args.replay or args.data,
+        'samples': len(texts),
+        'duration': args.duration,
+        'slo_ms': args.slo_ms,
+        'max_error_rate': args.max_error_rate,
+        'steps': steps,
+        'saturation': saturation,
+    }
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(result, json.load(f))
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print('结果已保存到 {}'.format(args.save))
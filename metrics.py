@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+'''
+@desc: 服务端监控指标，按Prometheus文本格式输出给 /metrics。
+       计数器和直方图在每个线程里各有一份分片，记录时只写本线程的分片、不加锁；抓取时再把所有分片加起来。
+'''
+import time
+import bisect
+import threading
+import contextlib
+
+# 各阶段耗时的直方图分桶(秒)，从0.1毫秒到10秒
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                             for k, v in pairs)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _ShardedMetric(object):
+    """Base class for metrics whose state is split into one shard per thread.
+
+    Each shard is a dict keyed by the label-value tuple and is only ever
+    written by its owning thread, so the hot path takes no lock. The lock is
+    used only when a thread records its first sample and when collecting.
+    """
+
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError("%s expects labels %s, got %s" % (self.name, self.labelnames, sorted(labels)))
+        return tuple(labels[k] for k in self.labelnames)
+
+    def _snapshot(self):
+        with self._lock:
+            return [dict(shard) for shard in self._shards]
+
+
+class Counter(_ShardedMetric):
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def collect(self):
+        totals = {}
+        for shard in self._snapshot():
+            for key, value in shard.items():
+                totals[key] = totals.get(key, 0) + value
+        return [(self.name, _format_labels(self.labelnames, key), value) for key, value in sorted(totals.items())]
+
+
+class Histogram(_ShardedMetric):
+    """Cumulative histogram in the Prometheus sense; `buckets` are upper bounds."""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        state = shard.get(key)
+        if state is None:
+            # [每个桶的计数(最后一个是+Inf), 总和]
+            state = shard[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self):
+        totals = {}
+        for shard in self._snapshot():
+            for key, (counts, total) in shard.items():
+                merged = totals.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0])
+                for i, c in enumerate(counts):
+                    merged[0][i] += c
+                merged[1] += total
+        samples = []
+        for key, (counts, total) in sorted(totals.items()):
+            cumulative = 0
+            for bound, c in zip(self.buckets + (float('inf'),), counts):
+                cumulative += c
+                samples.append((self.name + '_bucket',
+                                _format_labels(self.labelnames, key, ('le', _format_value(float(bound)))),
+                                cumulative))
+            samples.append((self.name + '_sum', _format_labels(self.labelnames, key), total))
+            samples.append((self.name + '_count', _format_labels(self.labelnames, key), cumulative))
+        return samples
+
+
+class CallbackMetric(object):
+    """A gauge or counter whose value is read from `fn()` at scrape time.
+
+    `fn` returns either a number or a dict mapping label-value tuples to
+    numbers. Used for state that is already tracked elsewhere (queue depth,
+    cache counters), so nothing extra happens on the hot path.
+    """
+
+    def __init__(self, name, documentation, fn, type_name='gauge', labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.fn = fn
+        self.type_name = type_name
+        self.labelnames = tuple(labelnames)
+
+    def collect(self):
+        value = self.fn()
+        if value is None:
+            return []
+        if not isinstance(value, dict):
+            return [(self.name, '', value)]
+        return [(self.name, _format_labels(self.labelnames, key), v) for key, v in sorted(value.items())]
+
+
+class Registry(object):
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if any(m.name == metric.name for m in self._metrics):
+                raise ValueError("Duplicated metric name %s" % metric.name)
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge_fn(self, name, documentation, fn, labelnames=()):
+        return self.register(CallbackMetric(name, documentation, fn, 'gauge', labelnames))
+
+    def counter_fn(self, name, documentation, fn, labelnames=()):
+        return self.register(CallbackMetric(name, documentation, fn, 'counter', labelnames))
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.documentation.replace('\\', '\\\\').replace('\n', '\\n')))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type_name))
+            for name, labels, value in metric.collect():
+                lines.append('%s%s %s' % (name, labels, _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+REGISTRY = Registry()
+
+# 推理路径上各个阶段的耗时，在 predict.py 里记录
+STAGE_SECONDS = REGISTRY.histogram(
+    'bert_stage_seconds', 'Time spent per inference stage: prefilter, tokenize (FullTokenizer.tokenize), '
+    'convert (convert_examples_to_arrays for a whole batch, including tokenize), model (session run) '
+    'and postprocess.', ['stage'])
+BATCH_SIZE = REGISTRY.histogram(
+    'bert_batch_size', 'Number of texts per predict_batch call (batch) and per BERT forward pass (model).',
+    ['kind'], buckets=BATCH_SIZE_BUCKETS)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+'''
+@desc: 基于 .npy 内存映射的特征存储，可以替代TFRecord。token id 按定长存成 [样本数, max_seq_length] 的int32矩阵，
+       另存每条样本的真实长度、第二句的起始位置和标签；input_mask、segment_ids 在取批次时由长度现算。
+       读的时候用 mmap 打开，连续切片不复制，打乱时只按下标取出一个批次的行，不需要逐条解析protobuf。
+'''
+import os
+import json
+
+import numpy as np
+
+from parallel_features import is_manifest, read_manifest
+
+NPY_SUFFIX = '.npy_features'
+_ARRAYS = ('input_ids', 'lengths', 'segment_starts', 'label_ids')
+
+
+def is_npy_features(path):
+    return path.rstrip('/\\').endswith(NPY_SUFFIX)
+
+
+def resolve_npy_features(input_file):
+    """input_file 是npy特征目录，或是只有一个npy分片的清单(特征缓存写的)时返回目录路径，否则返回 None。"""
+    if is_npy_features(input_file):
+        return input_file
+    if is_manifest(input_file):
+        shards = read_manifest(input_file)
+        if len(shards) == 1 and is_npy_features(shards[0]):
+            return shards[0]
+    return None
+
+
+def stack_features(features):
+    """把 `InputFeatures` 列表拼成 write_npy_features 需要的 (input_ids, segment_ids, label_ids, lengths)。"""
+    input_mask = np.array([f.input_mask for f in features], dtype=np.int32)
+    return (np.array([f.input_ids for f in features], dtype=np.int32),
+            np.array([f.segment_ids for f in features], dtype=np.int32),
+            np.array([f.label_id for f in features], dtype=np.int32),
+            input_mask.sum(axis=1).astype(np.int32))
+
+
+def write_npy_features(output_dir, num_examples, max_seq_length, batches):
+    """按顺序写入若干批特征，返回 output_dir。
+
+    batches 依次产生 (input_ids, segment_ids, label_ids, lengths) 数组，行数合计必须等于 num_examples。
+    矩阵用 open_memmap 预先分配在磁盘上，写入时不会在内存里攒下全部特征。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    arrays = {
+        'input_ids': np.lib.format.open_memmap(os.path.join(output_dir, 'input_ids.npy'), mode='w+',
+                                               dtype=np.int32, shape=(num_examples, max_seq_length)),
+        'lengths': np.zeros(num_examples, dtype=np.int32),
+        'segment_starts': np.zeros(num_examples, dtype=np.int32),
+        'label_ids': np.zeros(num_examples, dtype=np.int32),
+    }
+    start = 0
+    for input_ids, segment_ids, label_ids, lengths in batches:
+        end = start + len(lengths)
+        if end > num_examples:
+            raise ValueError('More than %d examples were written to %s' % (num_examples, output_dir))
+        arrays['input_ids'][start:end] = input_ids
+        arrays['lengths'][start:end] = lengths
+        # 第二句占据 [segment_start, length)，没有第二句时 segment_start 等于 length
+        arrays['segment_starts'][start:end] = lengths - segment_ids.sum(axis=1)
+        arrays['label_ids'][start:end] = label_ids
+        start = end
+    if start != num_examples:
+        raise ValueError('Expected %d examples for %s, got %d' % (num_examples, output_dir, start))
+
+    arrays['input_ids'].flush()
+    del arrays['input_ids']
+    for name in ('lengths', 'segment_starts', 'label_ids'):
+        np.save(os.path.join(output_dir, name + '.npy'), arrays[name])
+    with open(os.path.join(output_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'num_examples': num_examples, 'max_seq_length': max_seq_length}, f)
+    return output_dir
+
+
+class NpyFeatures(object):
+    """Read-only view of a directory written by `write_npy_features`.
+
+    Arrays are opened with `mmap_mode='r'`: contiguous slices are views into
+    the page cache, and a shuffled batch copies only its own rows.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        for name in _ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, name + '.npy'), mmap_mode='r'))
+        self.max_seq_length = self.input_ids.shape[1]
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def batch(self, indices, seq_length=None):
+        """取出 indices(切片或下标数组)对应的行，返回模型需要的int32特征字典，序列截到 seq_length。"""
+        seq_length = seq_length or self.max_seq_length
+        lengths = np.asarray(self.lengths[indices])
+        positions = np.arange(seq_length, dtype=np.int32)
+        input_mask = positions < lengths[:, None]
+        segment_ids = (positions >= np.asarray(self.segment_starts[indices])[:, None]) & input_mask
+        return {
+            'input_ids': np.ascontiguousarray(self.input_ids[indices, :seq_length]),
+            'input_mask': input_mask.astype(np.int32),
+            'segment_ids': segment_ids.astype(np.int32),
+            'label_ids': np.asarray(self.label_ids[indices]),
+            'is_real_example': np.ones(len(lengths), dtype=np.int32),
+        }
+
+    def iter_batches(self, batch_size, shuffle=False, repeat=False, drop_remainder=False, length_buckets=None,
+                     seed=None):
+        """逐批产生特征字典。
+
+        不打乱也不分桶时按顺序取连续切片，批次顺序与样本顺序一致。指定 length_buckets(升序、最后一个不小于
+        max_seq_length)时，每批只含同一个桶里的样本并补齐到桶边界，和 TFRecord 路径的 bucket_by_sequence_length 一样。
+        打乱时每轮重新排列样本，批内下标排好序，读 mmap 时尽量顺序访问。
+        """
+        rng = np.random.RandomState(seed)
+        num_examples = len(self)
+        while True:
+            order = rng.permutation(num_examples) if shuffle else np.arange(num_examples)
+            if length_buckets:
+                bucket_of = np.searchsorted(length_buckets, np.asarray(self.lengths)[order])
+                groups = [(length_buckets[b], order[bucket_of == b]) for b in range(len(length_buckets))]
+            else:
+                groups = [(None, order)]
+            batches = []
+            for width, members in groups:
+                for start in range(0, len(members), batch_size):
+                    indices = members[start:start + batch_size]
+                    if len(indices) < batch_size and drop_remainder:
+                        continue
+                    batches.append((width, indices))
+            if shuffle:
+                rng.shuffle(batches)
+            for width, indices in batches:
+                if not shuffle and width is None:
+                    yield self.batch(slice(indices[0], indices[-1] + 1))
+                else:
+                    yield self.batch(np.sort(indices) if shuffle else indices, width)
+            if not repeat:
+                break
+
+
+def npy_dataset(path, batch_size, is_training, drop_remainder, length_buckets=None):
+    """用 NpyFeatures 的批次生成器构造 tf.data.Dataset，训练时无限重复并每轮重新打乱。"""
+    import tensorflow as tf
+
+    features = NpyFeatures(path)
+    names = ('input_ids', 'input_mask', 'segment_ids', 'label_ids', 'is_real_example')
+    shapes = {name: tf.TensorShape([None, None] if name in names[:3] else [None]) for name in names}
+    generator = lambda: features.iter_batches(batch_size, shuffle=is_training, repeat=is_training,
+                                              drop_remainder=drop_remainder, length_buckets=length_buckets)
+    d = tf.data.Dataset.from_generator(generator, {name: tf.int32 for name in names}, shapes)
+    return d.prefetch(2)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+'''
+@desc: 多进程特征转换。把样本按顺序切成连续的若干段，每个工作进程各自读取、分词、序列化并写一个TFRecord分片，
+       最后写一个清单文件(.manifest)列出全部分片。样本是 LineExamples 时传给工作进程的只是文件路径和这一段的字节偏移，
+       原始行由工作进程自己读，父进程不构造也不序列化任何样本。file_based_input_fn_builder 拿到清单文件时按分片并行读取。
+'''
+import os
+import json
+import multiprocessing
+
+MANIFEST_SUFFIX = '.manifest'
+
+_tokenizer = None
+
+
+def is_manifest(input_file):
+    return input_file.endswith(MANIFEST_SUFFIX)
+
+
+def read_manifest(manifest_file):
+    """返回清单里按样本顺序排列的分片路径。"""
+    with open(manifest_file, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    base_dir = os.path.dirname(manifest_file)
+    return [os.path.join(base_dir, shard['file']) for shard in manifest['shards']]
+
+
+def resolve_num_workers(num_workers):
+    """0 或 None 表示使用全部CPU核。"""
+    if not num_workers:
+        return multiprocessing.cpu_count()
+    return num_workers
+
+
+def _init_worker(vocab_file, do_lower_case):
+    # 每个工作进程各自建一份分词器，避免把词表和分词缓存在进程间来回序列化
+    global _tokenizer
+    import tokenization
+    _tokenizer = tokenization.FullTokenizer(vocab_file=vocab_file, do_lower_case=do_lower_case)
+
+
+def _write_shard(task):
+    import tensorflow as tf
+    from train_eval import convert_examples_to_arrays, feature_to_tf_example
+
+    examples, label_list, max_seq_length, shard_file = task
+    arrays = convert_examples_to_arrays(examples, label_list, max_seq_length, _tokenizer)
+    writer = tf.python_io.TFRecordWriter(shard_file)
+    for i in range(len(arrays)):
+        writer.write(feature_to_tf_example(arrays.feature(i)).SerializeToString())
+    writer.close()
+    return len(arrays)
+
+
+def parallel_convert_examples_to_features(examples, label_list, max_seq_length, vocab_file, do_lower_case,
+                                          output_file, num_workers=None):
+    """Converts `examples` into TFRecord shards in a process pool and returns the manifest path.
+
+    Shard i holds a contiguous slice of `examples`, so reading the shards in
+    manifest order yields the examples in their original order. A slice of
+    `LineExamples` pickles as the file path plus its offsets, so each worker
+    reads its own lines instead of receiving them from the parent. Worker
+    processes are spawned rather than forked because the parent has usually
+    imported TensorFlow already.
+    """
+    num_workers = max(1, min(resolve_num_workers(num_workers), len(examples)))
+    per_shard = max(1, (len(examples) + num_workers - 1) // num_workers)
+    num_shards = max(1, (len(examples) + per_shard - 1) // per_shard)
+    tasks = []
+    for i in range(num_shards):
+        shard_file = '%s-%05d-of-%05d' % (output_file, i, num_shards)
+        tasks.append((examples[i * per_shard:(i + 1) * per_shard], label_list, max_seq_length, shard_file))
+
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(num_workers, initializer=_init_worker, initargs=(vocab_file, do_lower_case)) as pool:
+        counts = pool.map(_write_shard, tasks, chunksize=1)
+
+    manifest_file = output_file + MANIFEST_SUFFIX
+    manifest = {
+        'num_examples': sum(counts),
+        'max_seq_length': max_seq_length,
+        'shards': [{'file': os.path.basename(task[-1]), 'num_examples': count} for task, count in zip(tasks, counts)],
+    }
+    with open(manifest_file, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest_file
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+'''
+@desc: BERT前面的廉价预筛模型：哈希n-gram特征 + 逻辑回归。明显是正常文件的样本直接返回，剩下的才交给BERT。
+       训练：python prefilter.py train      评估：python prefilter.py eval --threshold 0.05
+'''
+import os
+import re
+import math
+import zlib
+import pickle
+import random
+import argparse
+import threading
+from array import array
+
+_WORD = re.compile(r'\w+')
+
+
+def read_samples(file_path):
+    """读取 "标签\\t文本" 格式的数据文件，和 SelfProcessor 使用同一种格式。"""
+    samples = []
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            split_line = line.strip().split('\t')
+            if len(split_line) >= 2:
+                samples.append((split_line[0], split_line[1]))
+    return samples
+
+
+class HashedNgramModel(object):
+    """Logistic regression over hashed word uni/bi-grams, trained with AdaGrad SGD.
+
+    `predict_proba` returns the probability that a text is NOT `benign_label`.
+    """
+
+    def __init__(self, benign_label='0', num_buckets=1 << 18, ngram=2):
+        self.benign_label = benign_label
+        self.num_buckets = num_buckets
+        self.ngram = ngram
+        self.weights = array('f', [0.0]) * num_buckets
+        self.bias = 0.0
+
+    def features(self, text):
+        words = _WORD.findall(text.lower())
+        mask = self.num_buckets - 1
+        feats = set()
+        for n in range(1, self.ngram + 1):
+            for i in range(len(words) - n + 1):
+                feats.add(zlib.crc32(' '.join(words[i:i + n]).encode('utf-8')) & mask)
+        return feats
+
+    def _score(self, feats):
+        if not feats:
+            return self.bias
+        scale = 1.0 / math.sqrt(len(feats))
+        w = self.weights
+        return self.bias + scale * sum(w[i] for i in feats)
+
+    def predict_proba(self, text):
+        z = self._score(self.features(text))
+        z = max(-30.0, min(30.0, z))
+        return 1.0 / (1.0 + math.exp(-z))
+
+    def train(self, samples, epochs=5, learning_rate=0.5, l2=1e-6, seed=0):
+        """在 [(标签, 文本), ...] 上训练。正样本(非benign)通常很少，按类别比例加权。"""
+        data = [(self.features(text), 0.0 if label == self.benign_label else 1.0) for label, text in samples]
+        num_pos = sum(y for _, y in data)
+        pos_weight = (len(data) - num_pos) / num_pos if num_pos else 1.0
+        grad_sq = array('f', [1e-8]) * self.num_buckets
+        bias_grad_sq = 1e-8
+        rng = random.Random(seed)
+        w = self.weights
+        for epoch in range(epochs):
+            rng.shuffle(data)
+            for feats, y in data:
+                z = max(-30.0, min(30.0, self._score(feats)))
+                p = 1.0 / (1.0 + math.exp(-z))
+                g = (p - y) * (pos_weight if y else 1.0)
+                scale = 1.0 / math.sqrt(len(feats)) if feats else 0.0
+                for i in feats:
+                    gi = g * scale + l2 * w[i]
+                    grad_sq[i] += gi * gi
+                    w[i] -= learning_rate * gi / math.sqrt(grad_sq[i])
+                bias_grad_sq += g * g
+                self.bias -= learning_rate * g / math.sqrt(bias_grad_sq)
+        return self
+
+    def save(self, file_path):
+        state = {'benign_label': self.benign_label, 'num_buckets': self.num_buckets, 'ngram': self.ngram,
+                 'weights': self.weights.tobytes(), 'bias': self.bias}
+        with open(file_path, 'wb') as f:
+            pickle.dump(state, f)
+
+    @classmethod
+    def load(cls, file_path):
+        with open(file_path, 'rb') as f:
+            state = pickle.load(f)
+        model = cls(state['benign_label'], state['num_buckets'], state['ngram'])
+        model.weights = array('f')
+        model.weights.frombytes(state['weights'])
+        model.bias = state['bias']
+        return model
+
+
+class Prefilter(object):
+    """Serving-side wrapper that splits a batch into skipped and forwarded items."""
+
+    def __init__(self, model, threshold):
+        self.model = model
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.skipped = 0
+
+    def split(self, texts):
+        """返回 (直接判定为正常的 {下标: 置信度}, 需要交给BERT的下标列表)。"""
+        benign, rest = {}, []
+        for i, text in enumerate(texts):
+            p = self.model.predict_proba(text)
+            if p < self.threshold:
+                benign[i] = 1.0 - p
+            else:
+                rest.append(i)
+        with self._lock:
+            self.checked += len(texts)
+            self.skipped += len(benign)
+        return benign, rest
+
+    def stats(self):
+        with self._lock:
+            return {'threshold': self.threshold, 'checked': self.checked, 'skipped': self.skipped,
+                    'skip_rate': self.skipped / self.checked if self.checked else 0.0}
+
+
+def evaluate(model, samples, thresholds):
+    """在给定阈值下统计跳过比例，以及因为跳过而漏掉的恶意样本占全部恶意样本的比例。"""
+    scored = [(model.predict_proba(text), label != model.benign_label) for label, text in samples]
+    num_pos = sum(1 for _, positive in scored if positive)
+    rows = []
+    for t in thresholds:
+        skipped = [positive for p, positive in scored if p < t]
+        lost = sum(1 for positive in skipped if positive)
+        rows.append({'threshold': t, 'skip_rate': len(skipped) / len(scored) if scored else 0.0,
+                     'recall_lost': lost / num_pos if num_pos else 0.0, 'missed': lost})
+    return rows
+
+
+if __name__ == '__main__':
+    from arguments import arg_dic
+
+    parser = argparse.ArgumentParser(description='训练/评估BERT前面的预筛模型')
+    parser.add_argument('action', choices=['train', 'eval'])
+    parser.add_argument('--model_file', default=arg_dic['prefilter_file'])
+    parser.add_argument('--threshold', type=float, default=arg_dic['prefilter_threshold'])
+    parser.add_argument('--epochs', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.action == 'train':
+        samples = read_samples(os.path.join(arg_dic['data_dir'], 'train.txt'))
+        model = HashedNgramModel(benign_label=arg_dic['prefilter_benign_label']).train(samples, epochs=args.epochs)
+        model.save(args.model_file)
+        print('预筛模型已保存到 {}，训练样本 {} 条'.format(args.model_file, len(samples)))
+
+    model = HashedNgramModel.load(args.model_file)
+    test_samples = read_samples(os.path.join(arg_dic['data_dir'], 'test.txt'))
+    thresholds = sorted(set([args.threshold, 0.01, 0.02, 0.05, 0.1, 0.2, 0.3]))
+    print('test.txt 共 {} 条'.format(len(test_samples)))
+    for row in evaluate(model, test_samples, thresholds):
+        mark = '  <- 当前阈值' if row['threshold'] == args.threshold else ''
+        print('阈值 {:.3f}：跳过 {:6.2%}，召回损失 {:6.2%}（漏掉 {} 条）{}'.format(
+            row['threshold'], row['skip_rate'], row['recall_lost'], row['missed'], mark))
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+'''
+@desc: pre-fork 多进程服务。父进程只加载一次词表和标签，并把pb模型的权重导出成 mmap 的 .npy(见 shared_weights)，
+       然后fork出N个工作进程。词表等Python对象通过写时复制共享，权重则是所有进程映射同一份页缓存，
+       每个进程的 Session 里只有不含权重的图结构。工作进程可以逐个绑定到指定的CPU核上。
+'''
+import os
+import gc
+import socket
+import signal
+
+
+def resolve_affinity(workers, affinity):
+    """把配置展开成每个工作进程的CPU列表；None 表示不绑核。
+
+    affinity 可以是 None、'auto'（把当前进程可用的CPU平均分给各个工作进程），
+    或者长度等于 workers 的列表，例如 [[0, 1], [2, 3]]。
+    """
+    if not affinity:
+        return [None] * workers
+    if affinity == 'auto':
+        cpus = sorted(os.sched_getaffinity(0))
+        per_worker = max(1, len(cpus) // workers)
+        return [cpus[i * per_worker:(i + 1) * per_worker] or [cpus[i % len(cpus)]] for i in range(workers)]
+    if len(affinity) != workers:
+        raise ValueError("worker_cpu_affinity has %d entries but workers is %d" % (len(affinity), workers))
+    return [list(cpus) for cpus in affinity]
+
+
+def _run_worker(app, model, sock, cpus):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)  # 服务启动后由 server.py 换成重新加载模型
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+        # 每个进程的TF线程数和绑定的核数一致，避免进程之间互相抢核
+        model.session_config.intra_op_parallelism_threads = len(cpus)
+        model.session_config.inter_op_parallelism_threads = 1
+    app.run(sock=sock, workers=1)
+
+
+def serve_forever(app, model, host, port, workers, affinity=None, backlog=1024):
+    """在父进程加载模型后fork出 `workers` 个Sanic工作进程，共享同一个监听socket。
+
+    TensorFlow的线程池不能跨fork使用，所以 tf.Session 是在子进程里第一次预测时才创建的；
+    在那之前的Python对象（词表、分词器）和 mmap 打开的共享权重都由父进程准备好。
+    工作进程异常退出会被自动拉起。向父进程发 SIGHUP 会转发给所有工作进程，让它们一起重新加载模型。
+    """
+    model.preload()
+    # 冻结已有对象，子进程里的垃圾回收就不会去改这些对象的引用计数页，写时复制得以保持
+    gc.collect()
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+
+    cpu_sets = resolve_affinity(workers, affinity)
+    children = {}
+    stopping = []
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _run_worker(app, model, sock, cpu_sets[index])
+            finally:
+                os._exit(0)
+        children[pid] = index
+        print('工作进程 {} 已启动，pid={}，CPU={}'.format(index, pid, cpu_sets[index]))
+
+    def shutdown(signum, frame):
+        stopping.append(signum)
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def broadcast_reload(signum, frame):
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGHUP, broadcast_reload)
+    signal.signal(signal.SIGINT, shutdown)
+
+    for index in range(workers):
+        spawn(index)
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        if index is not None and not stopping:
+            print('工作进程 {} (pid={}) 退出，状态 {}，重新启动'.format(index, pid, status))
+            spawn(index)
+    sock.close()
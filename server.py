@@ -5,13 +5,93 @@
 @desc: 项目描述。
 @DateTime: Created on 2019/7/22, at 下午 05:07 by PyCharm
 '''
+import os
+import json
+import time
+import signal
+import asyncio
+from queue import Full
 
 from sanic import Sanic
-from sanic.response import json as Rjson
-from predict_GPU import Bert_Class
+from sanic.response import json as Rjson, stream, text as Rtext
+from predict import Bert_Class, arg_dic
+from batcher import BatchScheduler
+from cache import VerdictCache, SingleFlight, content_key
+from metrics import REGISTRY, CONTENT_TYPE
 
 app = Sanic()
 my = Bert_Class()
+batcher = None
+cache = VerdictCache(max_size=arg_dic['cache_size'], ttl=arg_dic['cache_ttl'])
+my.reload_callbacks.append(lambda version: cache.clear())  # 换模型后旧的判定结果全部作废
+# 超过这个字符数的文本在线程池里计算缓存键：64K字符约2.4ms，1M字符约50ms，而一次线程池往返约0.07ms
+EXECUTOR_KEY_CHARS = 1 << 16
+flight = SingleFlight()  # 内容相同、同时在途的请求只算一次
+
+# 监控指标。pre-fork模式下每个工作进程各自统计，/metrics 返回的是响应这次抓取的那个进程的数据
+http_requests = REGISTRY.counter('bert_http_requests_total', 'HTTP requests by route and status.', ['route', 'status'])
+classify_seconds = REGISTRY.histogram('bert_classify_seconds',
+                                      'End-to-end time per text, including cache lookup and queueing.', ['cache'])
+REGISTRY.gauge_fn('bert_queue_depth', 'Texts waiting in the batch scheduler queue.',
+                  lambda: batcher.queue_depth() if batcher else None)
+
+
+def stats_counters(stats_fn, pairs):
+    """把 stats() 里的几个计数整理成 {(标签值,): 数值}，供回调指标使用。每次抓取只调用一次 stats_fn。"""
+    def collect():
+        values = stats_fn()
+        return {(label,): values[key] for label, key in pairs}
+    return collect
+
+
+REGISTRY.counter_fn('bert_cache_events_total', 'Verdict cache lookups and removals by event.',
+                    stats_counters(cache.stats, (('hit', 'hits'), ('miss', 'misses'), ('eviction', 'evictions'),
+                                                 ('expiration', 'expirations'))),
+                    ['event'])
+REGISTRY.gauge_fn('bert_cache_size', 'Entries in the verdict cache.', lambda: cache.stats()['size'])
+REGISTRY.counter_fn('bert_singleflight_coalesced_total', 'Requests that joined an identical in-flight request.',
+                    lambda: flight.stats()['coalesced'])
+REGISTRY.counter_fn('bert_tokenizer_cache_events_total', 'Tokenizer word cache lookups by event.',
+                    stats_counters(my.tokenizer.cache.stats, (('hit', 'hits'), ('miss', 'misses'))), ['event'])
+REGISTRY.counter_fn('bert_prefilter_skipped_total', 'Texts answered by the pre-filter without running BERT.',
+                    lambda: my.prefilter.stats()['skipped'] if my.prefilter else None)
+
+
+@app.listener('before_server_start')
+async def setup_batcher(app, loop):
+    # 收到 SIGHUP 就重新加载模型。pre-fork 模式下父进程把 SIGHUP 转发给所有工作进程，各进程各自换模型、清缓存
+    loop.add_signal_handler(signal.SIGHUP, lambda: loop.run_in_executor(None, my.reload))
+    # 多个并发请求合并成一个batch再做前向计算。调度线程不能跨fork存活，所以每个工作进程各自创建
+    global batcher
+    batcher = BatchScheduler(my.predict_batch, max_batch_size=arg_dic['max_batch_size'],
+                             max_wait_ms=arg_dic['max_wait_ms'], max_queue_size=arg_dic['max_queue_size'])
+
+
+async def classify(text):
+    """先查结果缓存，没有命中再交给批处理调度器。队列已满时抛出 queue.Full。"""
+    start = time.perf_counter()
+    if len(text) > EXECUTOR_KEY_CHARS:
+        # 长文本的归一化和sha1要几十毫秒，放到线程池里算；短文本直接算，比切换线程还快
+        key = await asyncio.get_event_loop().run_in_executor(None, content_key, text, my.model_version)
+    else:
+        key = content_key(text, my.model_version)
+    result = cache.get(key)
+    if result is None:
+        future = flight.do(key, lambda: batcher.submit(text))
+        # 同一个future可能被多个请求共享，shield 保证某个客户端断开时不会取消其它人的推理
+        result = await asyncio.shield(asyncio.wrap_future(future))
+        cache.put(key, result)
+        classify_seconds.observe(time.perf_counter() - start, cache='miss')
+    else:
+        classify_seconds.observe(time.perf_counter() - start, cache='hit')
+    return result
+
+
+@app.middleware('response')
+async def count_request(request, response):
+    # 未知路径统一归到 other，避免标签值无限增长
+    route = request.path if response.status != 404 else 'other'
+    http_requests.inc(route=route, status=response.status)
 
 
 @app.route("/", methods=['GET', 'POST'])
@@ -29,11 +109,110 @@ async def home(request):
     if not key_str or not user:  # 如果有空的字段，返回警告信息。
         return Rjson(dict1)
 
-    # 2，调用自身的功能，执行搜索引擎爬虫
+    # 2，查缓存或提交给批处理调度器，等待本条请求的结果。推理在调度线程里执行，事件循环不会被阻塞
     dict1.pop('tips')
-    dict1['Type'] = my.yuce(key_str)
+    try:
+        label, score = await classify(key_str)
+    except Full:
+        return Rjson({'error': '服务繁忙，请稍后重试'}, status=503)
+    dict1['Type'] = label
     return Rjson(dict1)
 
 
+def parse_batch_items(body):
+    """解析批量请求体：JSON数组，或者每行一个JSON对象的NDJSON。"""
+    text = body.decode('utf-8', 'ignore').strip()
+    if text.startswith('['):
+        items = json.loads(text)
+    else:
+        items = [json.loads(line) for line in text.splitlines() if line.strip()]
+    if not isinstance(items, list):
+        raise ValueError('请求体必须是JSON数组或NDJSON')
+    return items
+
+
+@app.route("/batch", methods=['POST'])
+async def batch(request):
+    # 请求体是 [{"id": .., "text": ..}, ...]，逐条返回 {"id": .., "Type": .., "score": ..} 的NDJSON
+    try:
+        items = parse_batch_items(request.body)
+    except ValueError as e:
+        return Rjson({'error': str(e)}, status=400)
+    if len(items) > arg_dic['batch_max_items']:
+        return Rjson({'error': '单次最多提交%d条' % arg_dic['batch_max_items']}, status=413)
+
+    async def streaming_fn(response):
+        # 同一个请求最多只有 window 条在排队，既能凑满batch，也不会把其它客户端的请求堵在后面
+        window = arg_dic['max_batch_size'] * 2
+        todo = iter(enumerate(items))
+        pending = {}
+
+        async def fill():
+            for index, item in todo:
+                item_id = item.get('id', index) if isinstance(item, dict) else index
+                text = item.get('text') if isinstance(item, dict) else None
+                if not isinstance(text, str) or not text:
+                    await response.write(json.dumps({'id': item_id, 'error': '缺少text字段'}, ensure_ascii=False) + '\n')
+                    continue
+                pending[asyncio.ensure_future(classify(text))] = item_id
+                if len(pending) >= window:
+                    break
+
+        await fill()
+        while pending:
+            done, _ = await asyncio.wait(list(pending), return_when=asyncio.FIRST_COMPLETED)
+            lines = []
+            for future in done:
+                item_id = pending.pop(future)
+                if isinstance(future.exception(), Full):
+                    lines.append({'id': item_id, 'error': '服务繁忙'})
+                elif future.exception() is not None:
+                    lines.append({'id': item_id, 'error': str(future.exception())})
+                else:
+                    label, score = future.result()
+                    lines.append({'id': item_id, 'Type': label, 'score': score})
+            # 算完一批就立刻写回，客户端不用等整个请求结束
+            await response.write(''.join(json.dumps(x, ensure_ascii=False) + '\n' for x in lines))
+            await fill()
+
+    return stream(streaming_fn, content_type='application/x-ndjson; charset=utf-8')
+
+
+@app.route("/health", methods=['GET'])
+async def health(request):
+    # 不经过模型，推理繁忙时也能立即响应
+    return Rjson({'status': 'ok'})
+
+
+@app.route("/reload", methods=['POST'])
+async def reload(request):
+    # 只接受本机调用。pre-fork 模式下请求只会落到某一个工作进程，所以交给父进程广播 SIGHUP，所有进程一起重新加载
+    if request.ip not in ('127.0.0.1', '::1'):
+        return Rjson({'error': 'forbidden'}, status=403)
+    if arg_dic['workers'] > 1:
+        os.kill(os.getppid(), signal.SIGHUP)
+        return Rjson({'status': 'reloading all workers'}, status=202)
+    # 重新导出pb模型之后调用，同时清空结果缓存
+    version = await asyncio.get_event_loop().run_in_executor(None, my.reload)
+    return Rjson({'model_version': version})
+
+
+@app.route("/stats", methods=['GET'])
+async def stats(request):
+    return Rjson({'batcher': batcher.stats(), 'cache': cache.stats(), 'singleflight': flight.stats(),
+                  'prefilter': my.prefilter.stats() if my.prefilter else None,
+                  'tokenizer_cache': my.tokenizer.cache.stats(),
+                  'model_version': my.model_version})
+
+
+@app.route("/metrics", methods=['GET'])
+async def metrics(request):
+    return Rtext(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5400)
+    if arg_dic['workers'] > 1:
+        from prefork import serve_forever
+        serve_forever(app, my, "0.0.0.0", 5400, arg_dic['workers'], arg_dic['worker_cpu_affinity'])
+    else:
+        app.run(host="0.0.0.0", port=5400)
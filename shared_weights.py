@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+'''
+@desc: 多进程共享模型权重。把冻结pb里的大常量(各层的权重矩阵)抽出来存成 .npy 文件，图里对应的节点换成同名的 placeholder；
+       各个进程用 mmap 打开这些 .npy，预测时作为 feed 传进去。TF 直接使用对齐的numpy数组的内存而不复制，
+       所以所有工作进程用的都是页缓存里的同一份权重，图本身只剩下几百KB的结构。
+'''
+import os
+import json
+import shutil
+
+import numpy as np
+
+MANIFEST_NAME = 'weights.json'
+
+
+def externalize_constants(graph_def, min_bytes=1 << 16):
+    """把 graph_def 里不小于 min_bytes 的常量换成 placeholder，返回 (新的 graph_def, {节点名: 数组})。"""
+    import tensorflow as tf
+
+    stripped = tf.GraphDef()
+    stripped.CopyFrom(graph_def)
+    arrays = {}
+    for node in stripped.node:
+        if node.op != 'Const':
+            continue
+        tensor = node.attr['value'].tensor
+        if tensor.dtype == tf.string.as_datatype_enum:
+            continue
+        value = tf.make_ndarray(tensor)
+        if value.nbytes < min_bytes:
+            continue
+        arrays[node.name] = value
+        node.op = 'Placeholder'
+        node.attr['shape'].shape.CopyFrom(tensor.tensor_shape)
+        del node.attr['value']
+    return stripped, arrays
+
+
+def save_weights(graph_def, output_dir, min_bytes=1 << 16):
+    """把抽出的常量写成 output_dir 下的 .npy，连同去掉权重的图一起保存，返回 output_dir。
+
+    先写到临时目录再改名，多个进程同时导出同一个版本时只有一个生效，不会读到写了一半的文件。
+    """
+    if os.path.exists(os.path.join(output_dir, MANIFEST_NAME)):
+        return output_dir
+    stripped, arrays = externalize_constants(graph_def, min_bytes)
+    tmp_dir = '%s.tmp-%d' % (output_dir.rstrip('/\\'), os.getpid())
+    os.makedirs(tmp_dir, exist_ok=True)
+    files = {}
+    for i, (name, value) in enumerate(arrays.items()):
+        files[name] = '%04d.npy' % i
+        # .npy 的数据区按64字节对齐，mmap 之后满足 TF 免复制 feed 的对齐要求
+        np.save(os.path.join(tmp_dir, files[name]), np.ascontiguousarray(value))
+    with open(os.path.join(tmp_dir, 'graph.pb'), 'wb') as f:
+        f.write(stripped.SerializeToString())
+    with open(os.path.join(tmp_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump({'files': files}, f, ensure_ascii=False, indent=2)
+    try:
+        os.rename(tmp_dir, output_dir)
+    except OSError:
+        if not os.path.exists(os.path.join(output_dir, MANIFEST_NAME)):
+            raise
+        shutil.rmtree(tmp_dir)  # 别的进程已经导出好了
+    return output_dir
+
+
+class SharedWeights(object):
+    """Weights saved by `save_weights`, opened read-only with `mmap_mode='r'`.
+
+    `graph_def` is the stripped graph; `arrays` maps each replaced node name
+    to its memory-mapped value, to be fed on every `Session.run`.
+    """
+
+    def __init__(self, weights_dir):
+        import tensorflow as tf
+
+        self.weights_dir = weights_dir
+        with open(os.path.join(weights_dir, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            files = json.load(f)['files']
+        self.graph_def = tf.GraphDef()
+        with open(os.path.join(weights_dir, 'graph.pb'), 'rb') as f:
+            self.graph_def.ParseFromString(f.read())
+        self.arrays = {name: np.load(os.path.join(weights_dir, file_name), mmap_mode='r')
+                       for name, file_name in files.items()}
+
+    def feeds(self, graph):
+        """返回 {placeholder 张量: mmap 数组}，直接合并进 feed_dict。"""
+        return {graph.get_tensor_by_name(name + ':0'): value for name, value in self.arrays.items()}
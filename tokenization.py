@@ -19,10 +19,16 @@ from __future__ import division
 from __future__ import print_function
 
 import collections
+import mmap
+import os
 import re
+import struct
+import sys
+import threading
 import unicodedata
+import zlib
+from array import array
 import six
-import tensorflow as tf
 
 
 def validate_case_matches_checkpoint(do_lower_case, init_checkpoint):
@@ -119,10 +125,16 @@ def printable_text(text):
 
 
 def load_vocab(vocab_file):
-  """Loads a vocabulary file into a dictionary."""
+  """Loads a vocabulary file into a dictionary.
+
+  A file written by `write_compiled_vocab` is recognised by its header and
+  memory-mapped as a `CompiledVocab` instead of being parsed.
+  """
+  if is_compiled_vocab(vocab_file):
+    return CompiledVocab(vocab_file)
   vocab = collections.OrderedDict()
   index = 0
-  with tf.gfile.GFile(vocab_file, "r") as reader:
+  with _open_text(vocab_file) as reader:
     while True:
       token = convert_to_unicode(reader.readline())
       if not token:
@@ -133,6 +145,167 @@ def load_vocab(vocab_file):
   return vocab
 
 
+def _open_text(path):
+  # TensorFlow is only needed for remote paths such as gs://; importing it
+  # just to read a local vocab file dominates CLI startup.
+  if os.path.exists(path):
+    return open(path, "rb")
+  import tensorflow as tf
+  return tf.gfile.GFile(path, "r")
+
+
+_COMPILED_VOCAB_MAGIC = b"BERTVOC1"
+# magic, number of tokens, number of hash buckets, size of the string blob.
+_COMPILED_VOCAB_HEADER = struct.Struct("<8sIII")
+
+
+def is_compiled_vocab(vocab_file):
+  if not os.path.isfile(vocab_file):
+    return False
+  with open(vocab_file, "rb") as f:
+    return f.read(len(_COMPILED_VOCAB_MAGIC)) == _COMPILED_VOCAB_MAGIC
+
+
+def write_compiled_vocab(vocab, output_file):
+  """Writes `vocab` (token -> id, ids 0..n-1) in the `CompiledVocab` format.
+
+  Layout, all integers little-endian uint32:
+    header   magic, num_tokens, num_buckets, blob_size
+    offsets  num_tokens + 1 byte offsets into the blob, indexed by id
+    buckets  open-addressing hash table (crc32, linear probing) of id + 1,
+             0 marking an empty bucket
+    blob     the UTF-8 tokens concatenated in id order
+  """
+  tokens = [None] * len(vocab)
+  for token, index in vocab.items():
+    if not 0 <= index < len(tokens) or tokens[index] is not None:
+      raise ValueError("Vocab ids must be unique and in [0, %d)." % len(tokens))
+    tokens[index] = token
+  encoded = [token.encode("utf-8") for token in tokens]
+
+  offsets = array("I", [0])
+  for data in encoded:
+    offsets.append(offsets[-1] + len(data))
+  blob_size = offsets[-1]
+  num_buckets = 1
+  while num_buckets < 2 * len(encoded):
+    num_buckets *= 2
+  buckets = array("I", [0]) * num_buckets
+  for index, data in enumerate(encoded):
+    bucket = zlib.crc32(data) & (num_buckets - 1)
+    while buckets[bucket]:
+      bucket = (bucket + 1) & (num_buckets - 1)
+    buckets[bucket] = index + 1
+  if sys.byteorder != "little":
+    offsets.byteswap()
+    buckets.byteswap()
+
+  tmp_file = output_file + ".tmp"
+  with open(tmp_file, "wb") as f:
+    f.write(_COMPILED_VOCAB_HEADER.pack(_COMPILED_VOCAB_MAGIC, len(encoded),
+                                        num_buckets, blob_size))
+    f.write(offsets.tobytes())
+    f.write(buckets.tobytes())
+    f.write(b"".join(encoded))
+  os.replace(tmp_file, output_file)
+
+
+class CompiledVocab(object):
+  """Read-only token -> id mapping backed by a memory-mapped file.
+
+  Opening one costs a header read and an mmap, whatever the vocab size, and
+  all processes that map the same file share its pages through the page
+  cache. It supports the dict operations the tokenizers use (`in`, `[]`,
+  `get`, `len`, iteration in id order, `keys`, `items`); `token(id)` looks
+  up the reverse direction without building an inverse dict.
+  """
+
+  def __init__(self, vocab_file):
+    with open(vocab_file, "rb") as f:
+      self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, num_tokens, num_buckets, blob_size = (
+        _COMPILED_VOCAB_HEADER.unpack_from(self._mmap, 0))
+    if magic != _COMPILED_VOCAB_MAGIC:
+      raise ValueError("%s is not a compiled vocab file." % vocab_file)
+    view = memoryview(self._mmap)
+    start = _COMPILED_VOCAB_HEADER.size
+    self._offsets = self._uint32_array(view[start:start + 4 * (num_tokens + 1)])
+    start += 4 * (num_tokens + 1)
+    self._buckets = self._uint32_array(view[start:start + 4 * num_buckets])
+    start += 4 * num_buckets
+    self._blob = view[start:start + blob_size]
+    if len(self._blob) != blob_size:
+      raise ValueError("%s is truncated." % vocab_file)
+    self._num_tokens = num_tokens
+    self._mask = num_buckets - 1
+
+  @staticmethod
+  def _uint32_array(view):
+    if sys.byteorder == "little":
+      return view.cast("I")
+    values = array("I", view.tobytes())
+    values.byteswap()
+    return values
+
+  def _bytes(self, index):
+    return self._blob[self._offsets[index]:self._offsets[index + 1]]
+
+  def token(self, index):
+    return self._bytes(index).tobytes().decode("utf-8")
+
+  def get(self, token, default=None):
+    data = token.encode("utf-8")
+    bucket = zlib.crc32(data) & self._mask
+    while True:
+      slot = self._buckets[bucket]
+      if not slot:
+        return default
+      if self._bytes(slot - 1) == data:
+        return slot - 1
+      bucket = (bucket + 1) & self._mask
+
+  def __getitem__(self, token):
+    index = self.get(token)
+    if index is None:
+      raise KeyError(token)
+    return index
+
+  def __contains__(self, token):
+    return self.get(token) is not None
+
+  def __len__(self):
+    return self._num_tokens
+
+  def __iter__(self):
+    for index in range(self._num_tokens):
+      yield self.token(index)
+
+  def keys(self):
+    return iter(self)
+
+  def items(self):
+    for index in range(self._num_tokens):
+      yield self.token(index), index
+
+  def inverse(self):
+    """An id -> token mapping that decodes on demand."""
+    return _CompiledInverseVocab(self)
+
+
+class _CompiledInverseVocab(object):
+
+  def __init__(self, vocab):
+    self._vocab = vocab
+
+  def __getitem__(self, index):
+    if not 0 <= index < len(self._vocab):
+      raise KeyError(index)
+    return self._vocab.token(index)
+
+  def __len__(self):
+    return len(self._vocab)
+
+
 def convert_by_vocab(vocab, items):
   """Converts a sequence of [tokens|ids] using the vocab."""
   output = []
@@ -158,22 +331,133 @@ def whitespace_tokenize(text):
   return tokens
 
 
+class TokenCache(object):
+  """A bounded, thread-safe cache from a whitespace token to its word pieces.
+
+  Args:
+    capacity: Maximum number of entries. 0 disables the cache.
+    policy: "lru" evicts the least recently used entry and moves an entry to
+      the back on every hit; "fifo" evicts the oldest insertion and makes hits
+      a plain dict lookup.
+  """
+
+  def __init__(self, capacity=100000, policy="lru"):
+    if policy not in ("lru", "fifo"):
+      raise ValueError("Unsupported cache policy: %s" % policy)
+    self.capacity = capacity
+    self.policy = policy
+    self._data = collections.OrderedDict()
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def get(self, key):
+    with self._lock:
+      value = self._data.get(key)
+      if value is None:
+        self.misses += 1
+        return None
+      if self.policy == "lru":
+        self._data.move_to_end(key)
+      self.hits += 1
+      return value
+
+  def put(self, key, value):
+    if self.capacity <= 0:
+      return
+    with self._lock:
+      self._data[key] = value
+      while len(self._data) > self.capacity:
+        self._data.popitem(last=False)
+        self.evictions += 1
+
+  def clear(self):
+    with self._lock:
+      self._data.clear()
+
+  def stats(self):
+    with self._lock:
+      lookups = self.hits + self.misses
+      return {
+          "size": len(self._data),
+          "capacity": self.capacity,
+          "policy": self.policy,
+          "hits": self.hits,
+          "misses": self.misses,
+          "evictions": self.evictions,
+          "hit_rate": self.hits / lookups if lookups else 0.0,
+      }
+
+
 class FullTokenizer(object):
-  """Runs end-to-end tokenziation."""
+  """Runs end-to-end tokenziation.
+
+  Results are memoized per whitespace token in `cache` (see `TokenCache`);
+  `cache_size=0` turns the cache off. One instance may be shared by threads.
+  """
 
-  def __init__(self, vocab_file, do_lower_case=True):
+  def __init__(self, vocab_file, do_lower_case=True, cache_size=100000,
+               cache_policy="lru"):
     self.vocab = load_vocab(vocab_file)
-    self.inv_vocab = {v: k for k, v in self.vocab.items()}
+    self._inv_vocab = None
     self.basic_tokenizer = BasicTokenizer(do_lower_case=do_lower_case)
     self.wordpiece_tokenizer = WordpieceTokenizer(vocab=self.vocab)
+    self.cache = TokenCache(cache_size, cache_policy)
 
-  def tokenize(self, text):
-    split_tokens = []
-    for token in self.basic_tokenizer.tokenize(text):
-      for sub_token in self.wordpiece_tokenizer.tokenize(token):
-        split_tokens.append(sub_token)
+  def tokenize(self, text, max_tokens=None):
+    """Tokenizes `text` into word pieces.
 
-    return split_tokens
+    With `max_tokens`, the text is consumed lazily and work stops as soon as
+    that many pieces exist; the result equals `tokenize(text)[:max_tokens]`.
+    """
+    return self.tokenize_with_ids(text, max_tokens)[0]
+
+  def tokenize_with_ids(self, text, max_tokens=None):
+    """Returns (word pieces, vocab ids) for `text`, both served from the cache."""
+    split_tokens = []
+    ids = []
+    for token in self.basic_tokenizer.iter_split_text(text):
+      pieces, piece_ids = self._tokenize_token(token)
+      split_tokens.extend(pieces)
+      ids.extend(piece_ids)
+      if max_tokens is not None and len(split_tokens) >= max_tokens:
+        del split_tokens[max_tokens:]
+        del ids[max_tokens:]
+        break
+    return split_tokens, ids
+
+  def iter_tokenize(self, text):
+    """Yields the word pieces of `text` one at a time."""
+    for token in self.basic_tokenizer.iter_split_text(text):
+      for piece in self._tokenize_token(token)[0]:
+        yield piece
+
+  def _tokenize_token(self, token):
+    """Word pieces and ids of one whitespace token, memoized in `cache`."""
+    entry = self.cache.get(token)
+    if entry is not None:
+      return entry
+    pieces = []
+    for sub_token in self.basic_tokenizer.tokenize_token(token):
+      # Tokens from BasicTokenizer contain no whitespace, so they can go
+      # straight to the per-word matcher.
+      pieces.extend(self.wordpiece_tokenizer.tokenize_word(sub_token))
+    entry = (tuple(pieces), tuple(convert_by_vocab(self.vocab, pieces)))
+    # Very long tokens are rare and would pin a lot of memory as keys.
+    if len(token) <= self.wordpiece_tokenizer.max_input_chars_per_word:
+      self.cache.put(token, entry)
+    return entry
+
+  @property
+  def inv_vocab(self):
+    # Built on first use: only id -> token conversions need it.
+    if self._inv_vocab is None:
+      if isinstance(self.vocab, CompiledVocab):
+        self._inv_vocab = self.vocab.inverse()
+      else:
+        self._inv_vocab = {v: k for k, v in self.vocab.items()}
+    return self._inv_vocab
 
   def convert_tokens_to_ids(self, tokens):
     return convert_by_vocab(self.vocab, tokens)
@@ -195,6 +479,51 @@ class BasicTokenizer(object):
 
   def tokenize(self, text):
     """Tokenizes a piece of text."""
+    output_tokens = []
+    for token in self.split_text(text):
+      output_tokens.extend(self.tokenize_token(token))
+    return output_tokens
+
+  def iter_tokenize(self, text):
+    """Lazily yields the same tokens as `tokenize`."""
+    for token in self.iter_split_text(text):
+      for sub_token in self.tokenize_token(token):
+        yield sub_token
+
+  def iter_split_text(self, text, chunk_size=256, max_chunk_size=8192):
+    """Lazily yields the same tokens as `split_text`.
+
+    Cleaning and CJK spacing are per-character, so the text is processed in
+    chunks that start at `chunk_size` characters and double up to
+    `max_chunk_size`; a token cut by a chunk boundary is carried over to the
+    next chunk. A caller that stops early never pays for the rest of the text,
+    while one that reads everything still works on large chunks.
+    """
+    text = convert_to_unicode(text)
+    carry = ""
+    start = 0
+    while start < len(text):
+      chunk = self._clean_text(text[start:start + chunk_size])
+      start += chunk_size
+      chunk_size = min(chunk_size * 2, max_chunk_size)
+      chunk = self._tokenize_chinese_chars(chunk)
+      if not chunk:
+        continue
+      tokens = (carry + chunk).split()
+      carry = ""
+      if tokens and not chunk[-1].isspace():
+        carry = tokens.pop()
+      for token in tokens:
+        yield token
+    if carry:
+      yield carry
+
+  def split_text(self, text):
+    """Cleans `text` and splits it on whitespace and around CJK characters.
+
+    Each returned token can be passed to `tokenize_token` on its own, which is
+    what lets `FullTokenizer` cache the work per token.
+    """
     text = convert_to_unicode(text)
     text = self._clean_text(text)
 
@@ -206,37 +535,37 @@ class BasicTokenizer(object):
     # words in the English Wikipedia.).
     text = self._tokenize_chinese_chars(text)
 
-    orig_tokens = whitespace_tokenize(text)
-    split_tokens = []
-    for token in orig_tokens:
-      if self.do_lower_case:
-        token = token.lower()
-        token = self._run_strip_accents(token)
-      split_tokens.extend(self._run_split_on_punc(token))
+    return whitespace_tokenize(text)
 
-    output_tokens = whitespace_tokenize(" ".join(split_tokens))
-    return output_tokens
+  def tokenize_token(self, token):
+    """Lower cases, strips accents and splits punctuation in one token."""
+    if self.do_lower_case:
+      token = token.lower()
+      token = self._run_strip_accents(token)
+    return whitespace_tokenize(" ".join(self._run_split_on_punc(token)))
 
   def _run_strip_accents(self, text):
     """Strips accents from a piece of text."""
+    # ASCII is unchanged by NFD and has no combining marks.
+    if text.isascii():
+      return text
     text = unicodedata.normalize("NFD", text)
-    output = []
-    for char in text:
-      cat = unicodedata.category(char)
-      if cat == "Mn":
-        continue
-      output.append(char)
-    return "".join(output)
+    return text.translate(_STRIP_ACCENTS_TABLE)
 
   def _run_split_on_punc(self, text):
     """Splits punctuation on a piece of text."""
+    if text.isascii():
+      # Every punctuation character becomes its own piece and the runs in
+      # between are kept whole; re.split with a capturing group does exactly
+      # that, leaving only empty strings to drop.
+      return [piece for piece in _ASCII_PUNC_RE.split(text) if piece]
     chars = list(text)
     i = 0
     start_new_word = True
     output = []
     while i < len(chars):
       char = chars[i]
-      if _is_punctuation(char):
+      if _PUNC_TABLE[ord(char)]:
         output.append([char])
         start_new_word = True
       else:
@@ -250,16 +579,9 @@ class BasicTokenizer(object):
 
   def _tokenize_chinese_chars(self, text):
     """Adds whitespace around any CJK character."""
-    output = []
-    for char in text:
-      cp = ord(char)
-      if self._is_chinese_char(cp):
-        output.append(" ")
-        output.append(char)
-        output.append(" ")
-      else:
-        output.append(char)
-    return "".join(output)
+    if text.isascii():
+      return text
+    return _CJK_RE.sub(r" \1 ", text)
 
   def _is_chinese_char(self, cp):
     """Checks whether CP is the codepoint of a CJK character."""
@@ -285,16 +607,28 @@ class BasicTokenizer(object):
 
   def _clean_text(self, text):
     """Performs invalid character removal and whitespace cleanup on text."""
-    output = []
-    for char in text:
-      cp = ord(char)
-      if cp == 0 or cp == 0xfffd or _is_control(char):
-        continue
-      if _is_whitespace(char):
-        output.append(" ")
-      else:
-        output.append(char)
-    return "".join(output)
+    return text.translate(_CLEAN_TABLE)
+
+
+# Key under which a trie node stores the vocab entry that ends at that node.
+# Edges are keyed by single characters, so the empty string cannot collide.
+_TRIE_END = ""
+
+
+def _build_trie(entries):
+  """Builds a character trie of nested dicts from (key, vocab entry) pairs."""
+  root = {}
+  for key, word in entries:
+    if not key:
+      continue
+    node = root
+    for char in key:
+      child = node.get(char)
+      if child is None:
+        child = node[char] = {}
+      node = child
+    node[_TRIE_END] = word
+  return root
 
 
 class WordpieceTokenizer(object):
@@ -304,6 +638,31 @@ class WordpieceTokenizer(object):
     self.vocab = vocab
     self.unk_token = unk_token
     self.max_input_chars_per_word = max_input_chars_per_word
+    # Built on the first word (or by `build_tries`), so constructing a
+    # tokenizer stays cheap.
+    self._start_trie = None
+    self._continuation_trie = None
+
+  def build_tries(self):
+    """Builds the prefix tries now instead of on the first word.
+
+    Serving processes call this before forking so that every worker shares
+    the tries instead of building its own copy on its first request.
+    """
+    if self._start_trie is None:
+      self._build_tries()
+
+  def _build_tries(self):
+    # Pieces that may start a word are matched verbatim; continuation pieces
+    # are matched without their "##" prefix, but the node stores the full
+    # vocab entry so no string has to be rebuilt after a match.
+    words = list(self.vocab)
+    continuation_trie = _build_trie(
+        (word[2:], word) for word in words if word.startswith("##"))
+    # Publish the start trie last: `tokenize_word` checks only that one, so
+    # another thread never sees a half-initialised pair.
+    self._continuation_trie = continuation_trie
+    self._start_trie = _build_trie((word, word) for word in words)
 
   def tokenize(self, text):
     """Tokenizes a piece of text into its word pieces.
@@ -315,6 +674,10 @@ class WordpieceTokenizer(object):
       input = "unaffable"
       output = ["un", "##aff", "##able"]
 
+    The longest match is found by a single walk down a prefix trie, so each
+    word costs O(n * longest piece) instead of O(n^2) substring joins and
+    lookups. The output is identical to `tokenize_reference`.
+
     Args:
       text: A single token or whitespace separated tokens. This should have
         already been passed through `BasicTokenizer.
@@ -325,6 +688,55 @@ class WordpieceTokenizer(object):
 
     text = convert_to_unicode(text)
 
+    output_tokens = []
+    for token in whitespace_tokenize(text):
+      output_tokens.extend(self.tokenize_word(token))
+    return output_tokens
+
+  def tokenize_word(self, token):
+    """Word pieces for a single whitespace-free token."""
+    num_chars = len(token)
+    if num_chars > self.max_input_chars_per_word:
+      return [self.unk_token]
+
+    # Most words are whole vocab entries; the longest match is then the word
+    # itself, so one lookup replaces the trie walk.
+    if token in self.vocab:
+      return [token]
+
+    if self._start_trie is None:
+      self._build_tries()
+    sub_tokens = []
+    trie = self._start_trie
+    start = 0
+    while start < num_chars:
+      node = trie
+      cur_substr = None
+      end = start
+      for i in range(start, num_chars):
+        node = node.get(token[i])
+        if node is None:
+          break
+        piece = node.get(_TRIE_END)
+        if piece is not None:
+          cur_substr = piece
+          end = i + 1
+      if cur_substr is None:
+        return [self.unk_token]
+      sub_tokens.append(cur_substr)
+      start = end
+      trie = self._continuation_trie
+    return sub_tokens
+
+  def tokenize_reference(self, text):
+    """The original substring-search implementation of `tokenize`.
+
+    Kept as the reference for equivalence checks (see `check_wordpiece.py`);
+    not used on any hot path.
+    """
+
+    text = convert_to_unicode(text)
+
     output_tokens = []
     for token in whitespace_tokenize(text):
       chars = list(token)
@@ -397,3 +809,52 @@ def _is_punctuation(char):
   if cat.startswith("P"):
     return True
   return False
+
+
+class _CharTable(dict):
+  """A `str.translate` table that computes entries on first use.
+
+  `fn(cp)` returns what the code point maps to (an ordinal, a string, or None
+  to delete it). Each code point is classified once per process, so the
+  `unicodedata` calls leave the per-character loop.
+  """
+
+  def __init__(self, fn):
+    super(_CharTable, self).__init__()
+    self._fn = fn
+
+  def __missing__(self, cp):
+    value = self[cp] = self._fn(cp)
+    return value
+
+
+def _clean_char(cp):
+  char = six.unichr(cp)
+  if cp == 0 or cp == 0xfffd or _is_control(char):
+    return None
+  if _is_whitespace(char):
+    return " "
+  return cp
+
+
+def _strip_accent_char(cp):
+  if unicodedata.category(six.unichr(cp)) == "Mn":
+    return None
+  return cp
+
+
+_CLEAN_TABLE = _CharTable(_clean_char)
+_STRIP_ACCENTS_TABLE = _CharTable(_strip_accent_char)
+_PUNC_TABLE = _CharTable(lambda cp: _is_punctuation(six.unichr(cp)))
+for _cp in range(128):
+  _CLEAN_TABLE[_cp]  # pylint: disable=pointless-statement
+  _PUNC_TABLE[_cp]  # pylint: disable=pointless-statement
+
+# Characters in the ASCII range that `_is_punctuation` accepts.
+_ASCII_PUNC_RE = re.compile(
+    "([%s])" % re.escape("".join(six.unichr(cp) for cp in range(128) if _PUNC_TABLE[cp])))
+
+# The same blocks as `BasicTokenizer._is_chinese_char`.
+_CJK_RE = re.compile(
+    u"([\u4E00-\u9FFF\u3400-\u4DBF\U00020000-\U0002A6DF\U0002A700-\U0002B73F"
+    u"\U0002B740-\U0002B81F\U0002B820-\U0002CEAF\uF900-\uFAFF\U0002F800-\U0002FA1F])")
@@ -15,8 +15,14 @@
 """BERT finetuning runner."""
 
 import os, csv, random, collections, pickle
+import numpy as np
 import modeling, optimization, tokenization
 from arguments import *
+from parallel_features import (is_manifest, read_manifest, resolve_num_workers,
+                               parallel_convert_examples_to_features)
+from feature_store import FeatureStore
+from example_reader import index_file, LineExamples
+from npy_features import NPY_SUFFIX, resolve_npy_features, write_npy_features, npy_dataset
 import warnings
 warnings.filterwarnings("ignore")
 os.environ['CUDA_VISIBLE_DEVICES'] = '1'
@@ -54,6 +60,34 @@ class InputFeatures(object):
         self.is_real_example = is_real_example
 
 
+class ArrayFeatures(object):
+    """A batch of features as int32 NumPy arrays, one row per example.
+
+    `input_ids`, `input_mask` and `segment_ids` are [batch, max_seq_length];
+    `label_ids` and `lengths` (real tokens including [CLS]/[SEP]) are [batch].
+    """
+
+    def __init__(self, input_ids, input_mask, segment_ids, label_ids, lengths):
+        self.input_ids = input_ids
+        self.input_mask = input_mask
+        self.segment_ids = segment_ids
+        self.label_ids = label_ids
+        self.lengths = lengths
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def take(self, indices):
+        """按下标取出若干行，返回新的 ArrayFeatures。"""
+        return ArrayFeatures(self.input_ids[indices], self.input_mask[indices], self.segment_ids[indices],
+                             self.label_ids[indices], self.lengths[indices])
+
+    def feature(self, i):
+        """第 i 行转换成 `InputFeatures`，供按条写TFRecord使用。"""
+        return InputFeatures(input_ids=self.input_ids[i].tolist(), input_mask=self.input_mask[i].tolist(),
+                             segment_ids=self.segment_ids[i].tolist(), label_id=int(self.label_ids[i]))
+
+
 class DataProcessor(object):
     """Base class for data converters for sequence classification data sets."""
 
@@ -89,57 +123,31 @@ class SelfProcessor(DataProcessor):
 
     def get_train_examples(self, data_dir):
         file_path = os.path.join(data_dir, 'train.txt')  # cnews.train.txt
-        with open(file_path, 'r', encoding="utf-8") as f:
-            reader = f.readlines()
         random.seed(0)
-        random.shuffle(reader)  # 注意要shuffle
-
-        examples, self.labels = [], []
-        for index, line in enumerate(reader):
-            guid = 'train-%d' % index
-            split_line = line.strip().split("\t")
-            text_a = tokenization.convert_to_unicode(split_line[1])
-            text_b = None
-            label = split_line[0]
-            examples.append(InputExample(guid=guid, text_a=text_a,
-                                         text_b=text_b, label=label))
-            self.labels.append(label)
-        return examples
+        offsets, self.labels = index_file(file_path, shuffle=True, collect_labels=True)  # 注意要shuffle
+        return LineExamples(file_path, offsets, self.create_example, 'train')
 
     def get_dev_examples(self, data_dir):
         file_path = os.path.join(data_dir, 'val.txt')
-        with open(file_path, 'r', encoding="utf-8") as f:
-            reader = f.readlines()
-        random.shuffle(reader)
-
-        examples = []
-        for index, line in enumerate(reader):
-            guid = 'dev-%d' % index
-            split_line = line.strip().split("\t")
-            text_a = tokenization.convert_to_unicode(split_line[1])
-            text_b = None
-            label = split_line[0]
-            examples.append(InputExample(guid=guid, text_a=text_a,
-                                         text_b=text_b, label=label))
-
-        return examples
+        offsets, _ = index_file(file_path, shuffle=True)
+        return LineExamples(file_path, offsets, self.create_example, 'dev')
 
     def get_test_examples(self, data_dir):
         file_path = os.path.join(data_dir, 'test.txt')
-        with open(file_path, 'r', encoding="utf-8") as f:
-            reader = f.readlines()
-        # random.shuffle(reader)  # 测试集不打乱数据，便于比较
-
-        examples = []
-        for index, line in enumerate(reader):
-            guid = 'test-%d' % index
-            split_line = line.strip().split("\t")
-            text_a = tokenization.convert_to_unicode(split_line[1])
-            text_b = None
-            label = split_line[0]
-            examples.append(InputExample(guid=guid, text_a=text_a,
-                                         text_b=text_b, label=label))
-        return examples
+        offsets, _ = index_file(file_path)  # 测试集不打乱数据，便于比较
+        return LineExamples(file_path, offsets, self.create_example, 'test')
+
+    def create_example(self, line, guid):
+        split_line = line.strip().split("\t")
+        text_a = tokenization.convert_to_unicode(split_line[1])
+        text_b = None
+        label = split_line[0]
+        return InputExample(guid=guid, text_a=text_a, text_b=text_b, label=label)
+
+    def create_examples(self, lines, set_type, start_index=0):
+        """每行是 `标签\t文本`，guid 按行号从 start_index 开始编。"""
+        return [self.create_example(line, '%s-%d' % (set_type, index))
+                for index, line in enumerate(lines, start_index)]
 
     def one_example(self, sentence):
         guid, label = 'pred-0', self.labels[0]
@@ -157,10 +165,12 @@ def convert_single_example(ex_index, example, label_list, max_seq_length, tokeni
     for (i, label) in enumerate(label_list):
         label_map[label] = i
 
-    tokens_a = tokenizer.tokenize(example.text_a)
+    # 超出 max_seq_length 的部分反正会被截掉，分词时达到预算就停下，不再处理长文本的剩余部分。
+    # 句对截断后每一句都不会超过 max_seq_length - 3，所以各自按这个预算分词，结果和先全量分词再截断一致
     tokens_b = None
     if example.text_b:
-        tokens_b = tokenizer.tokenize(example.text_b)
+        tokens_b = tokenizer.tokenize(example.text_b, max_tokens=max_seq_length - 3)
+    tokens_a = tokenizer.tokenize(example.text_a, max_tokens=max_seq_length - (3 if tokens_b else 2))
 
     if tokens_b:
         # Modifies `tokens_a` and `tokens_b` in place so that the total
@@ -223,39 +233,202 @@ def convert_single_example(ex_index, example, label_list, max_seq_length, tokeni
     return feature
 
 
+def convert_examples_to_arrays(examples, label_list, max_seq_length, tokenizer):
+    """把一批 `InputExample` 转换成 `ArrayFeatures`，结果与逐条调用 convert_single_example 完全一致。
+
+    三个矩阵预先按 [样本数, max_seq_length] 分配好并填0，每条样本只把分词得到的id写进对应的行，
+    不再逐条拼列表、补齐和断言；id 直接取自分词缓存，不再逐个查词表。
+    """
+    examples = list(examples)
+    label_map = {label: i for i, label in enumerate(label_list)}
+    cls_id, sep_id = tokenizer.convert_tokens_to_ids(["[CLS]", "[SEP]"])
+    input_ids = np.zeros((len(examples), max_seq_length), dtype=np.int32)
+    input_mask = np.zeros((len(examples), max_seq_length), dtype=np.int32)
+    segment_ids = np.zeros((len(examples), max_seq_length), dtype=np.int32)
+    label_ids = np.zeros(len(examples), dtype=np.int32)
+    lengths = np.zeros(len(examples), dtype=np.int32)
+
+    for i, example in enumerate(examples):
+        ids_b = None
+        if example.text_b:
+            ids_b = tokenizer.tokenize_with_ids(example.text_b, max_tokens=max_seq_length - 3)[1]
+        ids_a = tokenizer.tokenize_with_ids(example.text_a, max_tokens=max_seq_length - (3 if ids_b else 2))[1]
+        if ids_b:
+            _truncate_seq_pair(ids_a, ids_b, max_seq_length - 3)
+
+        row = input_ids[i]
+        row[0] = cls_id
+        length = 1 + len(ids_a)
+        row[1:length] = ids_a
+        row[length] = sep_id
+        length += 1
+        if ids_b:
+            end = length + len(ids_b)
+            row[length:end] = ids_b
+            row[end] = sep_id
+            segment_ids[i, length:end + 1] = 1
+            length = end + 1
+        input_mask[i, :length] = 1
+        lengths[i] = length
+        label_ids[i] = label_map[example.label]
+    return ArrayFeatures(input_ids, input_mask, segment_ids, label_ids, lengths)
+
+
+def window_starts(num_tokens, window, stride, max_windows):
+    """滑动窗口的起始位置：每隔 stride 个token开一个长 window 的窗口，最后一个窗口与结尾对齐，最多 max_windows 个。"""
+    starts = list(range(0, max(num_tokens - window, 0) + 1, stride))
+    if starts[-1] + window < num_tokens:
+        starts.append(num_tokens - window)
+    return starts[:max_windows]
+
+
+def convert_text_to_windows(text, max_seq_length, tokenizer, stride, max_windows):
+    """把一条长文本切成若干个相互重叠的窗口，每个窗口是一条 [CLS] 片段 [SEP]，返回 `ArrayFeatures`(标签全为0)。
+
+    只分词到最后一个窗口能用到的位置为止，超长文件后面的内容不会被分词。
+    """
+    window = max_seq_length - 2
+    ids = tokenizer.tokenize_with_ids(text, max_tokens=window + (max_windows - 1) * stride)[1]
+    starts = window_starts(len(ids), window, stride, max_windows)
+    cls_id, sep_id = tokenizer.convert_tokens_to_ids(["[CLS]", "[SEP]"])
+    input_ids = np.zeros((len(starts), max_seq_length), dtype=np.int32)
+    input_mask = np.zeros((len(starts), max_seq_length), dtype=np.int32)
+    lengths = np.zeros(len(starts), dtype=np.int32)
+    for i, start in enumerate(starts):
+        piece = ids[start:start + window]
+        input_ids[i, 0] = cls_id
+        input_ids[i, 1:len(piece) + 1] = piece
+        input_ids[i, len(piece) + 1] = sep_id
+        lengths[i] = len(piece) + 2
+        input_mask[i, :lengths[i]] = 1
+    return ArrayFeatures(input_ids, input_mask, np.zeros_like(input_ids), np.zeros(len(starts), dtype=np.int32),
+                         lengths)
+
+
+def feature_to_tf_example(feature):
+    """Converts an `InputFeatures` into a `tf.train.Example`."""
+
+    def create_int_feature(values):
+        f = tf.train.Feature(int64_list=tf.train.Int64List(value=list(values)))
+        return f
+
+    features = collections.OrderedDict()
+    features["input_ids"] = create_int_feature(feature.input_ids)
+    features["input_mask"] = create_int_feature(feature.input_mask)
+    features["segment_ids"] = create_int_feature(feature.segment_ids)
+    features["label_ids"] = create_int_feature([feature.label_id])
+    features["is_real_example"] = create_int_feature(
+        [int(feature.is_real_example)])
+
+    return tf.train.Example(features=tf.train.Features(feature=features))
+
+
 def file_based_convert_examples_to_features(
         examples, label_list, max_seq_length, tokenizer, output_file):
     """Convert a set of `InputExample`s to a TFRecord file."""
 
     writer = tf.python_io.TFRecordWriter(output_file)
 
-    for (ex_index, example) in enumerate(examples):
-        if ex_index % 10000 == 0:
-            tf.logging.info("Writing example %d of %d" % (ex_index, len(examples)))
-
-        feature = convert_single_example(ex_index, example, label_list,
-                                         max_seq_length, tokenizer)
-
-        def create_int_feature(values):
-            f = tf.train.Feature(int64_list=tf.train.Int64List(value=list(values)))
-            return f
+    # 每次转换一批样本，10000 条正好对应一条进度日志
+    for start in range(0, len(examples), 10000):
+        tf.logging.info("Writing example %d of %d" % (start, len(examples)))
+        arrays = convert_examples_to_arrays(examples[start:start + 10000], label_list, max_seq_length, tokenizer)
+        for i in range(len(arrays)):
+            writer.write(feature_to_tf_example(arrays.feature(i)).SerializeToString())
+    writer.close()
 
-        features = collections.OrderedDict()
-        features["input_ids"] = create_int_feature(feature.input_ids)
-        features["input_mask"] = create_int_feature(feature.input_mask)
-        features["segment_ids"] = create_int_feature(feature.segment_ids)
-        features["label_ids"] = create_int_feature([feature.label_id])
-        features["is_real_example"] = create_int_feature(
-            [int(feature.is_real_example)])
 
-        tf_example = tf.train.Example(features=tf.train.Features(feature=features))
-        writer.write(tf_example.SerializeToString())
-    writer.close()
+def file_based_convert_examples_to_npy(examples, label_list, max_seq_length, tokenizer, output_dir):
+    """Convert a set of `InputExample`s to a memory-mapped .npy feature directory."""
+    batches = (convert_examples_to_arrays(examples[start:start + 10000], label_list, max_seq_length, tokenizer)
+               for start in range(0, len(examples), 10000))
+    return write_npy_features(output_dir, len(examples), max_seq_length,
+                              ((a.input_ids, a.segment_ids, a.label_ids, a.lengths) for a in batches))
+
+
+def write_features(examples, label_list, tokenizer, output_file):
+    """按 feature_format、feature_workers 配置写特征，返回交给 file_based_input_fn_builder 的路径。
+
+    npy 格式返回特征目录；TFRecord 格式多进程时返回的是分片清单文件，单进程时就是 output_file 本身。
+    """
+    if arg_dic['feature_format'] == 'npy':
+        return file_based_convert_examples_to_npy(examples, label_list, arg_dic['max_seq_length'], tokenizer,
+                                                  os.path.splitext(output_file)[0] + NPY_SUFFIX)
+    if arg_dic['feature_format'] != 'tfrecord':
+        raise ValueError("Unknown feature_format: %s" % arg_dic['feature_format'])
+    if resolve_num_workers(arg_dic['feature_workers']) <= 1:
+        file_based_convert_examples_to_features(examples, label_list, arg_dic['max_seq_length'], tokenizer, output_file)
+        return output_file
+    tf.logging.info("Writing %d examples with %d processes" % (len(examples),
+                                                               resolve_num_workers(arg_dic['feature_workers'])))
+    return parallel_convert_examples_to_features(examples, label_list, arg_dic['max_seq_length'],
+                                                 arg_dic['vocab_file'], arg_dic['do_lower_case'], output_file,
+                                                 arg_dic['feature_workers'])
+
+
+def cached_features(store, processor, name, source_file, examples, label_list, tokenizer):
+    """从特征缓存取 name 对应的特征，缓存不可用时才转换；store 为 None 时和 write_features 一样每次重写。
+
+    增量更新时新追加的行按文件顺序转换成一个新的分片，训练集的这部分样本不参与 get_train_examples 的打乱，
+    训练时分片本身会被打乱、交错读取。
+    """
+    if store is None:
+        return write_features(examples, label_list, tokenizer,
+                              os.path.join(arg_dic['output_dir'], name + ".tf_record"))
+    return store.get_or_build(
+        name, source_file,
+        write_all=lambda output_file: write_features(examples, label_list, tokenizer, output_file),
+        write_lines=lambda lines, start_index, output_file: write_features(
+            processor.create_examples(lines, name, start_index), label_list, tokenizer, output_file),
+        # npy 特征是一整块定长矩阵，不能像TFRecord那样追加分片
+        incremental=arg_dic['feature_cache_incremental'] and arg_dic['feature_format'] != 'npy')
+
+
+def get_length_buckets(max_seq_length):
+    """Returns the sorted bucket lengths ending with `max_seq_length`, or [] when bucketing is off.
+
+    Bucketing is opt-in: an empty `length_buckets` in arg_dic turns it off.
+    """
+    if not arg_dic.get('length_buckets'):
+        return []
+    return sorted(b for b in arg_dic['length_buckets'] if b < max_seq_length) + [max_seq_length]
+
+
+def bucket_length(length, buckets):
+    """返回能放下 length 个token的最小桶长度。"""
+    for b in buckets:
+        if length <= b:
+            return b
+    return length
 
 
 def file_based_input_fn_builder(input_file, seq_length, is_training,
-                                drop_remainder):
-    """Creates an `input_fn` closure to be passed to TPUEstimator."""
+                                drop_remainder, length_buckets=None, batch_size=None):
+    """Creates an `input_fn` closure to be passed to TPUEstimator.
+
+    Records are batched first and then decoded a whole batch at a time with
+    `tf.parse_example`, on autotuned parallel map calls; the last stage
+    prefetches so the next batches are ready while the model runs.
+    `batch_size` defaults to `train_batch_size`; callers pass the eval or
+    predict batch size for those modes.
+
+    With `length_buckets`, `bucket_window_batches` batches of records are
+    decoded together, sorted by real length inside that window and split
+    back into batches, each trimmed to its bucket boundary. Decoding stays
+    batched and `drop_remainder` still applies. Batches then have a variable
+    sequence length and come out in a different order than the file, so this
+    is only meant for training and evaluation. An empty `length_buckets`
+    keeps every batch at `seq_length`.
+
+    `input_file` may be a shard manifest written by `parallel_features`. For
+    training the shards are read with parallel interleave; otherwise they are
+    read one after another so the record order matches the examples.
+
+    It may also be a .npy feature directory (feature_format "npy"), which is
+    batched straight from the memory map without parsing any records.
+    """
+    npy_path = resolve_npy_features(input_file)
+    autotune = tf.data.experimental.AUTOTUNE
 
     name_to_features = {
         "input_ids": tf.FixedLenFeature([seq_length], tf.int64),
@@ -265,9 +438,9 @@ def file_based_input_fn_builder(input_file, seq_length, is_training,
         "is_real_example": tf.FixedLenFeature([], tf.int64),
     }
 
-    def _decode_record(record, name_to_features):
-        """Decodes a record to a TensorFlow example."""
-        example = tf.parse_single_example(record, name_to_features)
+    def _decode_batch(records):
+        """Decodes a batch of serialized records into int32 tensors."""
+        example = tf.parse_example(records, name_to_features)
 
         # tf.Example only supports tf.int64, but the TPU only supports tf.int32.
         # So cast all int64 to int32.
@@ -279,23 +452,60 @@ def file_based_input_fn_builder(input_file, seq_length, is_training,
 
         return example
 
+    def _trim_batch(example):
+        # 每批只含长度相近的样本，截到能放下其中最长样本的桶边界
+        boundaries = tf.constant(length_buckets, dtype=tf.int32)
+        length = tf.reduce_max(tf.reduce_sum(example["input_mask"], axis=1))
+        width = tf.reduce_min(tf.boolean_mask(boundaries, boundaries >= length))
+        for name in ("input_ids", "input_mask", "segment_ids"):
+            example[name] = example[name][:, :width]
+        return example
+
+    def _split_by_length(example, size):
+        """把解析好的一大批按真实长度排序，再按顺序切成若干个 size 条的小批。"""
+        lengths = tf.reduce_sum(example["input_mask"], axis=1)
+        _, order = tf.nn.top_k(-lengths, k=tf.shape(lengths)[0])  # 升序
+        example = {name: tf.gather(t, order) for name, t in example.items()}
+        num_examples = tf.shape(lengths, out_type=tf.int64)[0]
+        num_batches = num_examples // size if drop_remainder else (num_examples + size - 1) // size
+        batches = tf.data.Dataset.range(num_batches)
+        if is_training:
+            batches = batches.shuffle(buffer_size=arg_dic['bucket_window_batches'])  # 窗口内不总是先短后长
+        return batches.map(lambda i: _trim_batch({name: t[i * size:(i + 1) * size] for name, t in example.items()}))
+
     def input_fn(params):
         """The actual input function."""
-        batch_size = arg_dic['train_batch_size']  # params["batch_size"]
+        size = batch_size or arg_dic['train_batch_size']  # params["batch_size"]
+
+        if npy_path:
+            return npy_dataset(npy_path, size, is_training, drop_remainder, length_buckets)
 
         # For training, we want a lot of parallel reading and shuffling.
         # For eval, we want no shuffling and parallel reading doesn't matter.
-        d = tf.data.TFRecordDataset(input_file)
+        if is_manifest(input_file):
+            shards = read_manifest(input_file)
+            if is_training:
+                d = tf.data.Dataset.from_tensor_slices(tf.constant(shards))
+                d = d.shuffle(buffer_size=len(shards)).repeat()
+                d = d.interleave(tf.data.TFRecordDataset, cycle_length=len(shards), num_parallel_calls=autotune)
+            else:
+                d = tf.data.TFRecordDataset(shards)
+        else:
+            d = tf.data.TFRecordDataset(input_file)
+            if is_training:
+                d = d.repeat()
         if is_training:
-            d = d.repeat()
-            d = d.shuffle(buffer_size=100)
+            d = d.shuffle(buffer_size=arg_dic['shuffle_buffer_size'])
 
-        d = d.apply(
-            tf.contrib.data.map_and_batch(
-                lambda record: _decode_record(record, name_to_features),
-                batch_size=batch_size,
-                drop_remainder=drop_remainder))
-        return d
+        if length_buckets:
+            # 一次解析 bucket_window_batches 批，在这个窗口内按长度分批，不再逐条拆开后重新分组
+            window = size * arg_dic['bucket_window_batches']
+            d = d.batch(window).map(_decode_batch, num_parallel_calls=autotune)
+            d = d.flat_map(lambda example: _split_by_length(example, size))
+        else:
+            d = d.batch(size, drop_remainder=drop_remainder)
+            d = d.map(_decode_batch, num_parallel_calls=autotune)
+        return d.prefetch(autotune)
 
     return input_fn
 
@@ -417,38 +627,27 @@ def model_fn_builder(bert_config, num_labels, init_checkpoint, learning_rate,
 def input_fn_builder(features, seq_length, is_training, drop_remainder):
     """Creates an `input_fn` closure to be passed to TPUEstimator."""
 
-    all_input_ids = []
-    all_input_mask = []
-    all_segment_ids = []
-    all_label_ids = []
-
-    for feature in features:
-        all_input_ids.append(feature.input_ids)
-        all_input_mask.append(feature.input_mask)
-        all_segment_ids.append(feature.segment_ids)
-        all_label_ids.append(feature.label_id)
+    # 既接受 `ArrayFeatures`，也接受 `InputFeatures` 列表；后者先拼成同样的数组
+    if not isinstance(features, ArrayFeatures):
+        features = ArrayFeatures(
+            np.array([f.input_ids for f in features], dtype=np.int32).reshape(-1, seq_length),
+            np.array([f.input_mask for f in features], dtype=np.int32).reshape(-1, seq_length),
+            np.array([f.segment_ids for f in features], dtype=np.int32).reshape(-1, seq_length),
+            np.array([f.label_id for f in features], dtype=np.int32),
+            np.array([sum(f.input_mask) for f in features], dtype=np.int32))
 
     def input_fn(params):
         """The actual input function."""
         batch_size = 200  # params["batch_size"]
 
-        num_examples = len(features)
-
         # This is for demo purposes and does NOT scale to large data sets. We do
         # not use Dataset.from_generator() because that uses tf.py_func which is
         # not TPU compatible. The right way to load data is with TFRecordReader.
         d = tf.data.Dataset.from_tensor_slices({
-            "input_ids":
-                tf.constant(all_input_ids, shape=[num_examples, seq_length],
-                            dtype=tf.int32),
-            "input_mask":
-                tf.constant(all_input_mask, shape=[num_examples, seq_length],
-                            dtype=tf.int32),
-            "segment_ids":
-                tf.constant(all_segment_ids, shape=[num_examples, seq_length],
-                            dtype=tf.int32),
-            "label_ids":
-                tf.constant(all_label_ids, shape=[num_examples], dtype=tf.int32),
+            "input_ids": features.input_ids[:, :seq_length],
+            "input_mask": features.input_mask[:, :seq_length],
+            "segment_ids": features.segment_ids[:, :seq_length],
+            "label_ids": features.label_ids,
         })
 
         if is_training:
@@ -509,8 +708,9 @@ def save_PBmodel( num_labels):
         pb_file = os.path.join(arg_dic['pb_model_dir'], 'classification_model.pb')
         graph = tf.Graph()
         with graph.as_default():
-            input_ids = tf.placeholder(tf.int32, (None, arg_dic['max_seq_length']), 'input_ids')
-            input_mask = tf.placeholder(tf.int32, (None, arg_dic['max_seq_length']), 'input_mask')
+            # 序列长度不固定，推理时可以只补齐到长度桶的边界，而不是一律补到 max_seq_length
+            input_ids = tf.placeholder(tf.int32, (None, None), 'input_ids')
+            input_mask = tf.placeholder(tf.int32, (None, None), 'input_mask')
             bert_config = modeling.BertConfig.from_json_file(arg_dic['bert_config_file'])
             loss, per_example_loss, logits, probabilities = create_classification_model(
                 bert_config=bert_config, is_training=False,
@@ -586,17 +786,24 @@ def main():
 
     estimator = tf.estimator.Estimator(model_fn=model_fn, config=run_config, )
 
+    store = None
+    if arg_dic['feature_cache']:
+        store = FeatureStore(os.path.join(arg_dic['output_dir'], 'features'), arg_dic['vocab_file'],
+                             arg_dic['do_lower_case'], arg_dic['max_seq_length'], label_list,
+                             arg_dic['feature_format'])
+
     if arg_dic['do_train']:
-        train_file = os.path.join(arg_dic['output_dir'], "train.tf_record")
-        file_based_convert_examples_to_features(
-            train_examples, label_list, arg_dic['max_seq_length'], tokenizer, train_file)
+        train_file = cached_features(store, processor, 'train', os.path.join(arg_dic['data_dir'], 'train.txt'),
+                                     train_examples, label_list, tokenizer)
         tf.logging.info("***** Running training *****")
         tf.logging.info("  Num examples = %d", len(train_examples))
         tf.logging.info("  Batch size = %d", arg_dic['train_batch_size'])
         tf.logging.info("  Num steps = %d", num_train_steps)
         train_input_fn = file_based_input_fn_builder(
             input_file=train_file, seq_length=arg_dic['max_seq_length'],
-            is_training=True, drop_remainder=True)
+            is_training=True, drop_remainder=True,
+            length_buckets=get_length_buckets(arg_dic['max_seq_length']),
+            batch_size=arg_dic['train_batch_size'])
         estimator.train(input_fn=train_input_fn, max_steps=num_train_steps)
 
     if arg_dic['do_eval']:
@@ -604,9 +811,8 @@ def main():
 
         num_actual_eval_examples = len(eval_examples)
 
-        eval_file = os.path.join(arg_dic['output_dir'], "eval.tf_record")
-        file_based_convert_examples_to_features(
-            eval_examples, label_list, arg_dic['max_seq_length'], tokenizer, eval_file)
+        eval_file = cached_features(store, processor, 'eval', os.path.join(arg_dic['data_dir'], 'val.txt'),
+                                    eval_examples, label_list, tokenizer)
 
         tf.logging.info("***** Running evaluation *****")
         tf.logging.info("  Num examples = %d (%d actual, %d padding)",
@@ -616,7 +822,9 @@ def main():
 
         eval_input_fn = file_based_input_fn_builder(
             input_file=eval_file, seq_length=arg_dic['max_seq_length'],
-            is_training=False, drop_remainder=False)
+            is_training=False, drop_remainder=False,
+            length_buckets=get_length_buckets(arg_dic['max_seq_length']),
+            batch_size=arg_dic['eval_batch_size'])
 
         result = estimator.evaluate(input_fn=eval_input_fn, )
 
@@ -632,9 +840,8 @@ def main():
 
         num_actual_predict_examples = len(predict_examples)
 
-        predict_file = os.path.join(arg_dic['output_dir'], "predict.tf_record")
-        file_based_convert_examples_to_features(predict_examples, label_list,
-                                                arg_dic['max_seq_length'], tokenizer, predict_file)
+        predict_file = cached_features(store, processor, 'predict', os.path.join(arg_dic['data_dir'], 'test.txt'),
+                                       predict_examples, label_list, tokenizer)
 
         tf.logging.info("***** Running prediction*****")
         tf.logging.info("  Num examples = %d (%d actual, %d padding)",
@@ -644,7 +851,8 @@ def main():
 
         predict_input_fn = file_based_input_fn_builder(
             input_file=predict_file, seq_length=arg_dic['max_seq_length'],
-            is_training=False, drop_remainder=False)
+            is_training=False, drop_remainder=False,
+            batch_size=arg_dic['predict_batch_size'])
 
         result = estimator.predict(input_fn=predict_input_fn)  # 执行预测操作，得到结果
 
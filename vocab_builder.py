@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+'''
+@desc: 针对语料扩充词表。原词表会把 DocumentBuilderFactory 这类代码标识符切成一长串 ## 碎片，白白占掉 max_seq_length 的预算。
+       这里从训练语料里统计按驼峰切开的代码子词，先填进词表里的 [unused] 空位，不够再追加到末尾；
+       同时改写checkpoint里的词向量矩阵(新词的向量初始化为它在原词表下各个碎片向量的均值)，并更新 bert_config.json 的 vocab_size。
+       用法：python vocab_builder.py --data ./data/train.txt --output_dir ./uncased_L-12_H-768_A-12_code/
+             之后把 arguments.py 里的 BERT_BASE_DIR 指向输出目录再训练。只想看词表效果时加 --skip_checkpoint。
+             python vocab_builder.py --compile_only 只把当前词表编译成可以mmap的 vocab.bin，把 vocab_file 指向它即可，
+             分词器按文件头自动识别。
+'''
+import os
+import re
+import json
+import argparse
+import collections
+
+import tokenization
+from arguments import arg_dic
+from example_reader import load_samples
+
+# 驼峰、全大写缩写、数字各自成段：XMLHttpRequest2 -> XML Http Request 2
+_SUBWORD_RE = re.compile(r'[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+')
+_UNUSED_RE = re.compile(r'^\[unused\d+\]$')
+
+EMBEDDING_NAME = 'bert/embeddings/word_embeddings'
+# 预训练checkpoint里MLM头的偏置，形状也是 [vocab_size]，一起扩展才能保持checkpoint自洽
+OUTPUT_BIAS_NAME = 'cls/predictions/output_bias'
+
+
+def split_identifier(word):
+    return _SUBWORD_RE.findall(word)
+
+
+def mine_candidates(texts, tokenizer, min_count=20, max_new_tokens=1000):
+    """统计代码子词，按估计能省下的token数从多到少返回 [(新词, 估计节省的token数), ...]。
+
+    按原大小写做基本分词(下划线等标点已经在这一步切开)，再按驼峰把每个词切成子词并规范化成词表的写法；
+    第一个子词作为词首词条，其余子词加 ## 作为词中词条。原词表里已有的、纯数字的、单个字符的子词都不考虑。
+    一个子词在原词表下切成 n 段，每出现一次就能省 n - 1 个token。
+    """
+    cased = tokenization.BasicTokenizer(do_lower_case=False)
+    words = collections.Counter()
+    for text in texts:
+        words.update(cased.tokenize(text))
+
+    vocab = tokenizer.vocab
+    normalize = tokenizer.basic_tokenizer.tokenize_token
+    wordpiece = tokenizer.wordpiece_tokenizer
+    savings = collections.Counter()
+    for word, count in words.items():
+        for i, sub in enumerate(split_identifier(word)):
+            if len(sub) < 2 or sub.isdigit():
+                continue
+            norm = ''.join(normalize(sub))
+            entry = norm if i == 0 else '##' + norm
+            if entry in vocab:
+                continue
+            savings[entry] += count * (len(wordpiece.tokenize_word(norm)) - 1)
+    return [(entry, saved) for entry, saved in savings.most_common(max_new_tokens) if saved >= min_count]
+
+
+def extend_vocab(vocab_tokens, new_tokens):
+    """先按顺序替换 [unusedN] 空位，剩下的追加到末尾。返回 (新词表, [(新词, 下标), ...])。"""
+    vocab_tokens = list(vocab_tokens)
+    unused = [i for i, token in enumerate(vocab_tokens) if _UNUSED_RE.match(token)]
+    placed = []
+    for token in new_tokens:
+        if unused:
+            index = unused.pop(0)
+            vocab_tokens[index] = token
+        else:
+            index = len(vocab_tokens)
+            vocab_tokens.append(token)
+        placed.append((token, index))
+    return vocab_tokens, placed
+
+
+def init_rows(matrix, placed, tokenizer):
+    """把新词所在的行设为它在原词表下各个碎片向量的均值；追加的行先补到矩阵末尾。
+
+    词中词条(##xxx)按词首的切法取碎片：只用来初始化，几步微调之后差别就没了。
+    """
+    import numpy as np
+    extra = max([index for _, index in placed] + [matrix.shape[0] - 1]) + 1 - matrix.shape[0]
+    if extra:
+        matrix = np.concatenate([matrix, np.zeros((extra,) + matrix.shape[1:], matrix.dtype)], axis=0)
+    for token, index in placed:
+        norm = token[2:] if token.startswith('##') else token
+        ids = tokenizer.convert_tokens_to_ids(tokenizer.wordpiece_tokenizer.tokenize_word(norm))
+        matrix[index] = matrix[ids].mean(axis=0)
+    return matrix
+
+
+def rewrite_checkpoint(init_checkpoint, output_checkpoint, placed, tokenizer, vocab_size):
+    """复制checkpoint，把词向量矩阵(以及MLM输出偏置)扩展到 vocab_size 并初始化新词所在的行。"""
+    import numpy as np
+    import tensorflow as tf
+
+    reader = tf.train.load_checkpoint(init_checkpoint)
+    shapes = reader.get_variable_to_shape_map()
+    if EMBEDDING_NAME not in shapes:
+        raise ValueError('%s 里没有词向量矩阵 %s' % (init_checkpoint, EMBEDDING_NAME))
+    values = {}
+    for name in shapes:
+        value = reader.get_tensor(name)
+        if name == EMBEDDING_NAME:
+            value = init_rows(value, placed, tokenizer)
+        elif name == OUTPUT_BIAS_NAME:
+            value = init_rows(value[:, None], placed, tokenizer)[:, 0]
+        values[name] = value
+    if values[EMBEDDING_NAME].shape[0] != vocab_size:
+        raise ValueError('词向量矩阵有 %d 行，新词表有 %d 个词' % (values[EMBEDDING_NAME].shape[0], vocab_size))
+
+    with tf.Graph().as_default():
+        # 先建变量再逐个 load，避免把几百MB的常量塞进计算图
+        variables = [tf.get_variable(name, shape=value.shape, dtype=tf.as_dtype(value.dtype))
+                     for name, value in values.items()]
+        saver = tf.train.Saver(variables)
+        with tf.Session() as sess:
+            for var, value in zip(variables, values.values()):
+                var.load(np.asarray(value), sess)
+            saver.save(sess, output_checkpoint, write_meta_graph=False)
+
+
+def tokens_per_sample(texts, tokenizer, max_seq_length):
+    """返回 (平均token数, 超出 max_seq_length 被截断的样本比例)。"""
+    lengths = [len(tokenizer.tokenize(text)) for text in texts]
+    if not lengths:
+        return 0.0, 0.0
+    budget = max_seq_length - 2  # [CLS] 和 [SEP]
+    return sum(lengths) / len(lengths), sum(1 for n in lengths if n > budget) / len(lengths)
+
+
+if __name__ == '__main__':
+    base_dir = os.path.dirname(arg_dic['vocab_file'])
+    parser = argparse.ArgumentParser(description='针对语料扩充BERT词表')
+    parser.add_argument('--data', default=os.path.join(arg_dic['data_dir'], 'train.txt'),
+                        help='"标签\\t文本" 格式的语料，多个文件用逗号分隔')
+    parser.add_argument('--limit', type=int, default=None, help='每个文件最多使用多少条样本')
+    parser.add_argument('--output_dir', default=base_dir.rstrip('/\\') + '_code')
+    parser.add_argument('--min_count', type=int, default=20, help='估计节省的token数少于这个值的子词不加')
+    parser.add_argument('--max_new_tokens', type=int, default=1000)
+    parser.add_argument('--skip_checkpoint', action='store_true', help='只生成词表和统计，不改写checkpoint')
+    parser.add_argument('--compile_only', action='store_true',
+                        help='只把 arguments.py 里的 vocab_file 编译成同目录下的 vocab.bin')
+    args = parser.parse_args()
+
+    if args.compile_only:
+        compiled_file = os.path.join(base_dir, 'vocab.bin')
+        tokenization.write_compiled_vocab(tokenization.load_vocab(arg_dic['vocab_file']), compiled_file)
+        print('已写入 {}'.format(compiled_file))
+        raise SystemExit(0)
+
+    texts = [text for file_path in args.data.split(',') for _, text in load_samples(file_path, args.limit)]
+    if not texts:
+        raise ValueError('没有可用的样本')
+    do_lower_case = arg_dic['do_lower_case']
+    old_tokenizer = tokenization.FullTokenizer(arg_dic['vocab_file'], do_lower_case=do_lower_case)
+
+    candidates = mine_candidates(texts, old_tokenizer, args.min_count, args.max_new_tokens)
+    vocab_tokens, placed = extend_vocab(old_tokenizer.vocab.keys(), [token for token, _ in candidates])
+    num_appended = len(vocab_tokens) - len(old_tokenizer.vocab)
+    print('新增 {} 个词：{} 个填进 [unused] 空位，{} 个追加到末尾'.format(
+        len(placed), len(placed) - num_appended, num_appended))
+    for token, saved in candidates[:20]:
+        print('  {:<24s} 约省 {} 个token'.format(token, saved))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    vocab_file = os.path.join(args.output_dir, 'vocab.txt')
+    with open(vocab_file, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(vocab_tokens) + '\n')
+    tokenization.write_compiled_vocab(tokenization.load_vocab(vocab_file), os.path.join(args.output_dir, 'vocab.bin'))
+    with open(arg_dic['bert_config_file'], 'r', encoding='utf-8') as f:
+        bert_config = json.load(f)
+    bert_config['vocab_size'] = len(vocab_tokens)
+    with open(os.path.join(args.output_dir, 'bert_config.json'), 'w', encoding='utf-8') as f:
+        json.dump(bert_config, f, indent=2)
+    if not args.skip_checkpoint:
+        rewrite_checkpoint(arg_dic['init_checkpoint'], os.path.join(args.output_dir, 'bert_model.ckpt'),
+                           placed, old_tokenizer, len(vocab_tokens))
+
+    new_tokenizer = tokenization.FullTokenizer(vocab_file, do_lower_case=do_lower_case)
+    max_seq_length = arg_dic['max_seq_length']
+    before = tokens_per_sample(texts, old_tokenizer, max_seq_length)
+    after = tokens_per_sample(texts, new_tokenizer, max_seq_length)
+    print('每条样本平均token数：{:.1f} -> {:.1f} ({:+.1%})'.format(
+        before[0], after[0], after[0] / before[0] - 1 if before[0] else 0.0))
+    print('超出 max_seq_length={} 被截断的样本：{:.1%} -> {:.1%}'.format(max_seq_length, before[1], after[1]))
+    print('已写入 {}，把 arguments.py 里的 BERT_BASE_DIR 指向这个目录后重新训练'.format(args.output_dir))